@@ -0,0 +1,265 @@
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+VERSION_CONTROL_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Version Control w_Compare.py')
+
+# Workbook shapes to benchmark; columns and calculated fields are per datasource
+SIZES = {
+    'small': {'worksheets': 20, 'dashboards': 5, 'datasources': 3, 'columns': 50, 'calculated_fields': 10},
+    'medium': {'worksheets': 100, 'dashboards': 20, 'datasources': 10, 'columns': 200, 'calculated_fields': 50},
+    'large': {'worksheets': 400, 'dashboards': 60, 'datasources': 25, 'columns': 500, 'calculated_fields': 150},
+}
+
+DATATYPES = ['string', 'integer', 'real', 'date']
+ROLES = ['dimension', 'measure']
+TYPES = ['nominal', 'quantitative', 'ordinal']
+
+# Changes applied to the second version of each workbook, as counts
+DEFAULT_CHANGES = {
+    'worksheets_added': 2,
+    'worksheets_removed': 1,
+    'worksheets_modified': 3,
+    'dashboards_modified': 1,
+    'columns_added': 2,
+    'columns_removed': 1,
+    'calculated_fields_modified': 3,
+    'custom_sql_modified': 1,
+}
+
+def load_version_control():
+    """Import the version control script as a module so its comparator can be timed directly."""
+    spec = importlib.util.spec_from_file_location('version_control', VERSION_CONTROL_SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def build_workbook(worksheets, dashboards, datasources, columns, calculated_fields, revision='1.0', changes=None):
+    """Build a synthetic .twb shaped like a Tableau workbook, with `changes` applied on top.
+
+    Everything is derived from element positions rather than random draws, so the two versions
+    differ by exactly the requested changes.
+    """
+    changes = changes or {}
+    workbook = ET.Element('workbook', {'source-build': '2023.1.0', 'version': '18.1'})
+    ET.SubElement(workbook, 'repository-location', {'id': 'SyntheticWorkbook', 'path': '/workbooks', 'revision': revision})
+    ds_container = ET.SubElement(workbook, 'datasources')
+    params = ET.SubElement(ds_container, 'datasource', {'hasconnection': 'false', 'inline': 'true', 'name': 'Parameters'})
+    for i in range(3):
+        ET.SubElement(params, 'column', {'caption': f'Parameter {i}', 'datatype': 'integer', 'name': f'[Parameter {i}]',
+                                         'param': 'true', 'role': 'measure', 'type': 'quantitative', 'value': str(i)})
+    ds_names = []
+    for d in range(datasources):
+        name = f'federated.{d:04d}'
+        ds_names.append(name)
+        ds = ET.SubElement(ds_container, 'datasource', {'caption': f'Data Source {d}', 'inline': 'true', 'name': name})
+        connection = ET.SubElement(ds, 'connection', {'class': 'federated'})
+        named = ET.SubElement(ET.SubElement(connection, 'named-connections'), 'named-connection', {'name': f'sqlserver.{d}'})
+        ET.SubElement(named, 'connection', {'class': 'sqlserver', 'dbname': 'Warehouse', 'server': f'db{d % 3}.example.com', 'authentication': 'sspi'})
+        if d == 0:
+            sql_version = 1 if changes.get('custom_sql_modified') else 0
+            relation = ET.SubElement(connection, 'relation', {'connection': f'sqlserver.{d}', 'name': 'Custom SQL Query', 'type': 'text'})
+            relation.text = f"SELECT * FROM dbo.Orders WHERE Version = {sql_version}"
+        else:
+            ET.SubElement(connection, 'relation', {'connection': f'sqlserver.{d}', 'name': f'Table{d}', 'table': f'[dbo].[Table{d}]', 'type': 'table'})
+        removed = changes.get('columns_removed', 0) if d == 0 else 0
+        added = changes.get('columns_added', 0) if d == 0 else 0
+        for c in range(removed, columns + added):
+            ET.SubElement(ds, 'column', {'datatype': DATATYPES[c % len(DATATYPES)], 'name': f'[Field {c}]',
+                                         'role': ROLES[c % len(ROLES)], 'type': TYPES[c % len(TYPES)]})
+        modified = changes.get('calculated_fields_modified', 0) if d == 0 else 0
+        for c in range(calculated_fields):
+            column = ET.SubElement(ds, 'column', {'caption': f'Calculation {c}', 'datatype': 'real', 'name': f'[Calculation_{d}_{c}]',
+                                                  'role': 'measure', 'type': 'quantitative'})
+            offset = 1 if c < modified else 0
+            ET.SubElement(column, 'calculation', {'class': 'tableau', 'formula': f'SUM([Field {c % columns}]) * {c + offset} / COUNTD([Field {(c + 1) % columns}])'})
+    ws_container = ET.SubElement(workbook, 'worksheets')
+    sheet_names = []
+    # Removed sheets come off the end and added ones go after them, so every other sheet keeps its name
+    removed = changes.get('worksheets_removed', 0)
+    modified = changes.get('worksheets_modified', 0)
+    added = range(worksheets, worksheets + changes.get('worksheets_added', 0))
+    for w in [*range(worksheets - removed), *added]:
+        name = f'Sheet {w}'
+        sheet_names.append(name)
+        ds_name = ds_names[w % len(ds_names)] if ds_names else 'Parameters'
+        worksheet = ET.SubElement(ws_container, 'worksheet', {'name': name})
+        table = ET.SubElement(worksheet, 'table')
+        view = ET.SubElement(table, 'view')
+        ET.SubElement(ET.SubElement(view, 'datasources'), 'datasource', {'name': ds_name})
+        deps = ET.SubElement(view, 'datasource-dependencies', {'datasource': ds_name})
+        for c in range(min(columns, 4)):
+            ET.SubElement(deps, 'column', {'datatype': 'real', 'name': f'[Field {(w + c) % columns}]', 'role': 'measure', 'type': 'quantitative'})
+        mark = 'Bar' if w < modified else 'Automatic'
+        pane = ET.SubElement(table, 'panes')
+        ET.SubElement(ET.SubElement(pane, 'pane'), 'mark', {'class': mark})
+        ET.SubElement(worksheet, 'simple-id', {'uuid': f'{{{w:032X}}}'})
+    db_container = ET.SubElement(workbook, 'dashboards')
+    for b in range(dashboards):
+        dashboard = ET.SubElement(db_container, 'dashboard', {'name': f'Dashboard {b}'})
+        width = '1200' if b < changes.get('dashboards_modified', 0) else '1000'
+        ET.SubElement(dashboard, 'size', {'maxheight': '800', 'maxwidth': width})
+        zones = ET.SubElement(dashboard, 'zones')
+        # Dashboards only show sheets from the first half, which no change adds or removes
+        for z, w in enumerate(range(b, worksheets // 2, max(dashboards, 1))):
+            if z == 6:
+                break
+            ET.SubElement(zones, 'zone', {'h': '50000', 'id': str(z + 1), 'name': f'Sheet {w}', 'w': '50000', 'x': '0', 'y': str(z * 1000)})
+    windows = ET.SubElement(workbook, 'windows')
+    for name in sheet_names:
+        ET.SubElement(windows, 'window', {'class': 'worksheet', 'name': name})
+    return ET.ElementTree(workbook)
+
+def write_workbook_pair(folder, base, shape, changes):
+    """Write {base}_2024-01-01.twb and {base}_2024-01-02.twb, the second carrying `changes`."""
+    os.makedirs(folder, exist_ok=True)
+    old_path = os.path.join(folder, f"{base}_2024-01-01.twb")
+    new_path = os.path.join(folder, f"{base}_2024-01-02.twb")
+    build_workbook(**shape, revision='1.0').write(old_path, encoding='utf-8', xml_declaration=True)
+    build_workbook(**shape, revision='1.1', changes=changes).write(new_path, encoding='utf-8', xml_declaration=True)
+    return old_path, new_path
+
+def extract_all(comparator, root):
+    index = comparator.index_workbook(root)
+    for ds in index['datasources'].values():
+        comparator.extract_datasource_details(ds, index)
+        comparator.extract_calculated_fields(ds, index)
+    return index
+
+def measure(fn, repeat):
+    """Return (best wall time in seconds, peak traced Python memory in MB) for fn()."""
+    best = None
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    # Memory is traced in a separate run so tracemalloc overhead doesn't skew the timings
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(best, 4), round(peak / (1024 * 1024), 2)
+
+def run_size(vc, size_name, shape, changes, repeat, work_dir):
+    folder = os.path.join(work_dir, size_name)
+    base = f"Benchmark_{size_name}"
+    old_path, new_path = write_workbook_pair(folder, base, shape, changes)
+    comparator = vc.TableauWorkbookComparator()
+    roots = {}
+
+    def parse():
+        roots['old'] = comparator.parse_workbook(old_path)
+        roots['new'] = comparator.parse_workbook(new_path)
+
+    def extract():
+        extract_all(comparator, roots['old'])
+        extract_all(comparator, roots['new'])
+
+    def compare():
+        roots['changes'] = vc.TableauWorkbookComparator().compare_workbooks(old_path, new_path)
+
+    def manage():
+        # Runs retention, revision checks, comparison and the changelog append on a fresh copy of the pair. Each run
+        # gets its own SAVE_DIR, so the revision index starts cold and backfill, search indexing and the dependency
+        # graph are timed as on a workbook's first run rather than served from the previous repeat
+        vc.SAVE_DIR = tempfile.mkdtemp(prefix=f"{size_name}_", dir=work_dir)
+        run_folder = os.path.join(vc.SAVE_DIR, base)
+        shutil.copytree(folder, run_folder)
+        vc.manage_copies(base, '.twb', run_folder)
+
+    result = {
+        'size': size_name,
+        'shape': shape,
+        'file_bytes': os.path.getsize(old_path) + os.path.getsize(new_path),
+    }
+    for phase, fn in (('parse', parse), ('extract', extract), ('compare', compare), ('manage_copies', manage)):
+        result[f'{phase}_seconds'], result[f'{phase}_peak_mb'] = measure(fn, repeat)
+    result['changes_found'] = {key: len(items) for key, items in sorted(roots['changes'].items()) if items}
+    return result
+
+def compare_results(previous, current, threshold):
+    """Print phases that got slower or larger than `threshold` (a fraction) since the previous results."""
+    previous_by_size = {r['size']: r for r in previous.get('results', [])}
+    regressions = 0
+    for result in current['results']:
+        before = previous_by_size.get(result['size'])
+        if before is None or before.get('shape') != result['shape']:
+            continue
+        for key, value in result.items():
+            if not key.endswith(('_seconds', '_peak_mb')) or not before.get(key):
+                continue
+            change = (value - before[key]) / before[key]
+            flag = 'REGRESSION' if change > threshold else ''
+            regressions += bool(flag)
+            print(f"{result['size']:>8} {key:<24} {before[key]:>10} -> {value:<10} {change:+7.1%} {flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the workbook comparator from 'Version Control w_Compare.py' on synthetic workbooks")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES), help='Workbook sizes to run')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per phase; the fastest is reported')
+    parser.add_argument('--output_file', default=f"comparator_benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json", help='Where to write the results as JSON')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Slowdown or memory growth, as a fraction, reported as a regression against --baseline')
+    parser.add_argument('--generate', metavar='FOLDER', help='Only write the synthetic workbook pairs to FOLDER and exit')
+    args = parser.parse_args()
+
+    if args.generate:
+        for size_name in args.sizes:
+            old_path, new_path = write_workbook_pair(args.generate, f"Benchmark_{size_name}", SIZES[size_name], DEFAULT_CHANGES)
+            print(f"Wrote {old_path} and {new_path}")
+        return
+
+    vc = load_version_control()
+    vc.logger.setLevel('WARNING')
+    work_dir = tempfile.mkdtemp(prefix='comparator_benchmark_')
+    # manage_copies keeps its revision index under SAVE_DIR; run_size points it at a new scratch folder per run
+    vc.SAVE_DIR = work_dir
+    try:
+        results = {
+            'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'lxml': vc.lxml_etree is not None,
+            'repeat': args.repeat,
+            'changes': DEFAULT_CHANGES,
+            'results': [],
+        }
+        for size_name in args.sizes:
+            result = run_size(vc, size_name, SIZES[size_name], DEFAULT_CHANGES, args.repeat, work_dir)
+            results['results'].append(result)
+            print(f"{size_name:>8}: parse {result['parse_seconds']}s ({result['parse_peak_mb']} MB), "
+                  f"extract {result['extract_seconds']}s ({result['extract_peak_mb']} MB), "
+                  f"compare {result['compare_seconds']}s ({result['compare_peak_mb']} MB), "
+                  f"manage_copies {result['manage_copies_seconds']}s ({result['manage_copies_peak_mb']} MB)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    with open(args.output_file, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output_file}")
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            previous = json.load(f)
+        regressions = compare_results(previous, results, args.threshold)
+        if regressions:
+            print(f"{regressions} regression(s) beyond {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,24 @@
 import requests
+from requests.adapters import HTTPAdapter
 import xml.etree.ElementTree as ET
 import pandas as pd
 import argparse
+import csv
+import itertools
+import json
+import os
+from datetime import datetime
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def sign_in(server_url, pat_name, pat_secret, site_content_url=''):
+import tabretry
+
+API_NS = '{http://tableau.com/api}'
+OUTPUT_COLUMNS = ['Project', 'Workbook', 'UpdatedAt', 'Id']
+REFRESH_COLUMNS = ['LastRefreshAt', 'RefreshDurationSeconds', 'RefreshSchedule']
+REFRESH_JOB_TYPES = ('refresh_extracts', 'increment_extracts')
+
+def sign_in(server_url, pat_name, pat_secret, site_content_url='', session=None):
     signin_url = f"{server_url}/api/3.4/auth/signin"
     payload = f"""
     <tsRequest>
@@ -13,7 +28,7 @@ def sign_in(server_url, pat_name, pat_secret, site_content_url=''):
     </tsRequest>
     """
     headers = {'Content-Type': 'application/xml'}
-    response = requests.post(signin_url, data=payload, headers=headers)
+    response = (session or make_session()).post(signin_url, data=payload, headers=headers)
     if response.status_code != 200:
         raise Exception(f"Sign-in failed: {response.text}")
     
@@ -24,43 +39,344 @@ def sign_in(server_url, pat_name, pat_secret, site_content_url=''):
     site_id = root.find('.//site').get('id')
     return auth_token, site_id
 
-def get_all_workbooks(server_url, site_id, auth_token):
-    data = []
-    page_number = 1
+def make_session(workers=1):
+    # Size the connection pool to the worker count so every thread reuses a kept-alive connection
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(workers, 1))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Every request, from any worker thread, is retried on throttling or server errors and counts against --max_requests_per_second
+    return tabretry.retrying_session(session)
+
+def iter_page_elements(stream, page_info, container_tag, item_tag):
+    # Walk the page incrementally and drop each element once it is read, so memory stays flat regardless of page size
+    container = None
+    for event, elem in ET.iterparse(stream, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == API_NS + container_tag:
+                container = elem
+            continue
+        if elem.tag == API_NS + 'pagination':
+            page_info['totalAvailable'] = int(elem.get('totalAvailable'))
+        elif elem.tag == API_NS + item_tag:
+            yield elem
+            elem.clear()
+            if container is not None:
+                container.clear()
+
+def iter_workbooks_page(stream, page_info):
+    for elem in iter_page_elements(stream, page_info, 'workbooks', 'workbook'):
+        project = elem.find(API_NS + 'project')
+        yield {
+            'Project': project.get('name') if project is not None else 'None',
+            'Workbook': elem.get('name'),
+            'UpdatedAt': elem.get('updatedAt'),
+            'Id': elem.get('id')
+        }
+
+def is_archived(row):
+    # Exclude workbooks and projects containing 'Archive'
+    return 'Archive' in row['Project'] or 'Archive' in row['Workbook']
+
+def fetch_workbooks_page(session, workbooks_url, auth_token, page_number, page_size, page_info, filter_expression=None):
+    # Rows are yielded while the response is still being read; page_info gets totalAvailable from the pagination element
+    paged_url = f"{workbooks_url}?pageSize={page_size}&pageNumber={page_number}"
+    if filter_expression:
+        paged_url += f"&filter={filter_expression}"
+    headers = {'X-Tableau-Auth': auth_token}
+    with session.get(paged_url, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Failed to get workbooks: {response.text}")
+        response.raw.decode_content = True
+        yield from iter_workbooks_page(response.raw, page_info)
+
+def iter_all_workbooks(server_url, site_id, auth_token, workers=1, session=None, updated_since=None):
     page_size = 1000 # Max page size
     workbooks_url = f"{server_url}/api/3.4/sites/{site_id}/workbooks"
+    filter_expression = f"updatedAt:gt:{updated_since}" if updated_since else None
+    if session is None:
+        session = make_session(workers)
+    fetch_page = lambda page_number: fetch_workbooks_page(session, workbooks_url, auth_token, page_number, page_size, {}, filter_expression)
     
+    # Page 1 tells us how many pages there are; the rest can be fetched in any order
+    page_info = {}
+    yield from fetch_workbooks_page(session, workbooks_url, auth_token, 1, page_size, page_info, filter_expression)
+    page_count = -(-page_info['totalAvailable'] // page_size)
+    remaining_pages = range(2, page_count + 1)
+    if workers > 1 and len(remaining_pages) > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Keep a bounded window of pages in flight and hand them out in page order, so row order
+            # matches a serial run and fetched pages can't pile up faster than they are written.
+            # Only these pages are read into lists, since a worker's page has to wait its turn
+            pending = deque()
+            for page_number in remaining_pages:
+                pending.append(executor.submit(list, fetch_page(page_number)))
+                if len(pending) >= workers * 2:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+    else:
+        for page_number in remaining_pages:
+            yield from fetch_page(page_number)
+
+def get_paged_items(session, url, auth_token, container_tag, item_tag, convert, filter_expression=None):
+    items = []
+    page_number = 1
+    page_size = 1000
     while True:
-        paged_url = f"{workbooks_url}?pageSize={page_size}&pageNumber={page_number}"
+        paged_url = f"{url}?pageSize={page_size}&pageNumber={page_number}"
+        if filter_expression:
+            paged_url += f"&filter={filter_expression}"
         headers = {'X-Tableau-Auth': auth_token}
-        response = requests.get(paged_url, headers=headers)
-        if response.status_code != 200:
-            raise Exception(f"Failed to get workbooks: {response.text}")
-        
-        # Parse response, ignoring namespace
-        response_text = response.text.replace('xmlns="http://tableau.com/api"', '')
-        root = ET.fromstring(response_text)
-        pagination = root.find('pagination')
-        total_available = int(pagination.get('totalAvailable'))
-        
-        for workbook in root.findall('.//workbook'):
-            project = workbook.find('project')
-            project_name = project.get('name') if project is not None else 'None'
-            workbook_name = workbook.get('name')
-            # Exclude workbooks and projects containing 'Archive'
-            if 'Archive' not in project_name and 'Archive' not in workbook_name:
-                updated_at = workbook.get('updatedAt')
-                data.append({
-                    'Project': project_name,
-                    'Workbook': workbook_name,
-                    'UpdatedAt': updated_at
-                })
-        
-        if page_number * page_size >= total_available:
+        with session.get(paged_url, headers=headers, stream=True) as response:
+            if response.status_code != 200:
+                raise Exception(f"Failed to get {container_tag}: {response.text}")
+            response.raw.decode_content = True
+            page_info = {}
+            for elem in iter_page_elements(response.raw, page_info, container_tag, item_tag):
+                items.append(convert(elem))
+        if page_number * page_size >= page_info.get('totalAvailable', 0):
             break
         page_number += 1
+    return items
+
+def get_all_sites(server_url, auth_token, session):
+    # Listing every site needs a server administrator token
+    return get_paged_items(session, f"{server_url}/api/3.4/sites", auth_token, 'sites', 'site',
+                           lambda site: (site.get('contentUrl', ''), site.get('name')))
+
+def get_refresh_schedules(server_url, site_id, auth_token, session):
+    # One call returns every extract refresh task on the site
+    tasks_url = f"{server_url}/api/3.4/sites/{site_id}/tasks/extractRefreshes"
+    headers = {'X-Tableau-Auth': auth_token}
+    schedules = {}
+    with session.get(tasks_url, headers=headers, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(f"Failed to get extract refresh tasks: {response.text}")
+        response.raw.decode_content = True
+        for task in iter_page_elements(response.raw, {}, 'tasks', 'task'):
+            workbook = task.find(f'{API_NS}extractRefresh/{API_NS}workbook')
+            schedule = task.find(f'{API_NS}extractRefresh/{API_NS}schedule')
+            if workbook is not None and schedule is not None:
+                schedule_name = schedule.get('name') or schedule.get('frequency')
+                schedules.setdefault(workbook.get('id'), set()).add(schedule_name)
+    return {wb_id: ', '.join(sorted(names)) for wb_id, names in schedules.items()}
+
+def get_job_workbook_id(server_url, site_id, auth_token, session, job_id):
+    # Used for jobs whose title doesn't identify the workbook; the result is cached so each job is looked up once
+    job_url = f"{server_url}/api/3.4/sites/{site_id}/jobs/{job_id}"
+    headers = {'X-Tableau-Auth': auth_token}
+    response = session.get(job_url, headers=headers)
+    if response.status_code != 200:
+        raise Exception(f"Failed to get job {job_id}: {response.text}")
+    workbook = ET.fromstring(response.content).find(f'.//{API_NS}workbook')
+    return workbook.get('id') if workbook is not None else None
+
+def get_workbook_ids_by_name(workbook_names):
+    # A refresh job's title is its workbook's name; names used by more than one workbook can't be matched that way
+    ids = {}
+    for wb_id, name in workbook_names.items():
+        ids.setdefault(name, []).append(wb_id)
+    return {name: wb_ids[0] for name, wb_ids in ids.items() if len(wb_ids) == 1}
+
+def parse_timestamp(value):
+    return datetime.fromisoformat(value.rstrip('Z') + '+00:00')
+
+def update_refresh_cache(server_url, site_id, auth_token, session, site_cache, by_name, workers=1):
+    jobs_since = site_cache.get('jobsSince')
+    # Full and incremental refreshes are separate job types; whichever finished last sets the workbook's refresh time
+    jobs = []
+    for job_type in REFRESH_JOB_TYPES:
+        filter_expression = f'jobType:eq:{job_type}' + (f',createdAt:gte:{jobs_since}' if jobs_since else '')
+        jobs += get_paged_items(session, f"{server_url}/api/3.4/sites/{site_id}/jobs", auth_token, 'backgroundJobs', 'backgroundJob',
+                                lambda job: dict(job.attrib), filter_expression)
+    succeeded = [job for job in jobs if job.get('status') == 'Success' and job.get('subtitle') != 'Data Source' and job.get('endedAt')]
+    
+    # Jobs behind an unfinished one are fetched again next run; the workbooks they were already matched to are kept
+    resolved = site_cache.get('resolvedJobs', {})
+    unresolved = [job for job in succeeded if job['id'] not in resolved]
+    if unresolved:
+        # Titles that aren't a known, unique workbook name are looked up job by job
+        matched = {job['id']: by_name[job['title']] for job in unresolved if job.get('subtitle') == 'Workbook' and job.get('title') and job['title'] in by_name}
+        lookups = [job for job in unresolved if job['id'] not in matched]
+        with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            matched.update(zip((job['id'] for job in lookups),
+                               executor.map(lambda job: get_job_workbook_id(server_url, site_id, auth_token, session, job['id']), lookups)))
+        resolved = {**resolved, **matched}
+    
+    refreshes = site_cache.setdefault('workbooks', {})
+    for job in unresolved:
+        wb_id = resolved[job['id']]
+        if wb_id is None:
+            continue
+        previous = refreshes.get(wb_id)
+        if previous is None or job['endedAt'] > previous['LastRefreshAt']:
+            duration = parse_timestamp(job['endedAt']) - parse_timestamp(job.get('startedAt') or job['endedAt'])
+            refreshes[wb_id] = {'LastRefreshAt': job['endedAt'], 'RefreshDurationSeconds': int(duration.total_seconds())}
     
-    return data
+    # Jobs still running are picked up again next time, so don't move the watermark past them
+    unfinished = [job['createdAt'] for job in jobs if job.get('status') in ('Pending', 'InProgress')]
+    site_cache['jobsSince'] = min(unfinished) if unfinished else max((job['createdAt'] for job in jobs), default=jobs_since)
+    # Only jobs at or after the watermark can come back, so older resolutions are dropped
+    site_cache['resolvedJobs'] = {job['id']: resolved[job['id']] for job in succeeded if job['createdAt'] >= site_cache['jobsSince']}
+    return len(unresolved)
+
+def add_refresh_times(rows, refreshes, schedules):
+    for row in rows:
+        refresh = refreshes.get(row['Id'], {})
+        row['LastRefreshAt'] = refresh.get('LastRefreshAt')
+        row['RefreshDurationSeconds'] = refresh.get('RefreshDurationSeconds')
+        row['RefreshSchedule'] = schedules.get(row['Id'])
+        yield row
+
+def iter_sites_workbooks(args, session, sites, state, use_watermarks, refresh_cache, refreshes, schedules):
+    # A PAT only holds one session at a time, so sites are visited in turn over the shared
+    # connection pool while pages within each site are fetched concurrently
+    for site_content_url, site_name in sites:
+        auth_token, site_id = sign_in(args.server_url, args.pat_name, args.pat_secret, site_content_url, session)
+        updated_since = state.get(site_content_url) if use_watermarks else None
+        rows = iter_all_workbooks(args.server_url, site_id, auth_token, workers=args.workers, session=session, updated_since=updated_since)
+        if args.refresh_times:
+            # Refresh jobs are matched to workbooks by name, so the site's listing is held until the jobs are resolved against it.
+            # An incremental run only lists changed workbooks, so names seen by earlier runs are kept in the cache
+            rows = list(rows)
+            site_cache = refresh_cache.setdefault(site_content_url, {})
+            workbook_names = site_cache.get('workbookNames', {}) if updated_since else {}
+            workbook_names.update((row['Id'], row['Workbook']) for row in rows)
+            site_cache['workbookNames'] = workbook_names
+            new_jobs = update_refresh_cache(args.server_url, site_id, auth_token, session, site_cache,
+                                            get_workbook_ids_by_name(workbook_names), args.workers)
+            print(f"Indexed {new_jobs} new extract refresh jobs from site '{site_content_url}'")
+            refreshes.update(site_cache.get('workbooks', {}))
+            schedules.update(get_refresh_schedules(args.server_url, site_id, auth_token, session))
+        watermark = updated_since
+        row_count = 0
+        for row in rows:
+            if is_archived(row):
+                continue
+            if site_name is not None:
+                row = {'Site': site_name, **row}
+            # updatedAt is ISO 8601 in UTC, so the string max is the latest timestamp
+            if row['UpdatedAt'] and (watermark is None or row['UpdatedAt'] > watermark):
+                watermark = row['UpdatedAt']
+            row_count += 1
+            yield row
+        if updated_since:
+            print(f"Fetched {row_count} workbooks updated since {updated_since} from site '{site_content_url}'")
+        if args.incremental and watermark:
+            state[site_content_url] = watermark
+
+class CsvSink:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.DictWriter(self.file, fieldnames=columns, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, row):
+        self.writer.writerow(row)
+
+    def close(self):
+        self.file.close()
+
+class JsonlSink:
+    def __init__(self, path, columns):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def write(self, row):
+        self.file.write(json.dumps({column: row.get(column) for column in self.columns}) + '\n')
+
+    def close(self):
+        self.file.close()
+
+class ParquetSink:
+    batch_size = 10000
+
+    def __init__(self, path, columns):
+        # pyarrow is only needed for this format
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([(column, pa.int64() if column == 'RefreshDurationSeconds' else pa.string()) for column in columns])
+        self.writer = pq.ParquetWriter(path, self.schema)
+        self.batch = []
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self.batch:
+            self.writer.write_table(self.pa.Table.from_pylist(self.batch, schema=self.schema))
+            self.batch = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+class ExcelSink:
+    # openpyxl builds the whole sheet in memory anyway, so this one buffers until close
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+    def close(self):
+        pd.DataFrame(self.rows, columns=self.columns).to_excel(self.path, index=False)
+
+SINKS = {
+    'xlsx': ExcelSink,
+    'csv': CsvSink,
+    'jsonl': JsonlSink,
+    'parquet': ParquetSink,
+}
+
+def iter_output_rows(path, output_format):
+    if output_format == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    elif output_format == 'jsonl':
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+    elif output_format == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches():
+            yield from batch.to_pylist()
+    else:
+        yield from pd.read_excel(path).to_dict('records')
+
+def load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, 'r') as f:
+        return json.load(f)
+
+def save_state(state_file, state):
+    with open(state_file, 'w') as f:
+        json.dump(state, f, indent=2)
+
+def load_previous_output(output_file, output_format):
+    # A previous file without the Id column can't be merged, so treat it as missing and do a full pull
+    if not os.path.exists(output_file):
+        return None
+    rows = iter_output_rows(output_file, output_format)
+    first_row = next(rows, None)
+    if first_row is None:
+        return iter(())
+    if 'Id' not in first_row:
+        return None
+    return itertools.chain([first_row], rows)
+
+def merge_workbooks(previous, updated):
+    # Updated workbooks replace their previous row in place; new ones are appended
+    for row in previous:
+        yield updated.pop(row['Id'], row)
+    yield from updated.values()
 
 def main():
     parser = argparse.ArgumentParser(description="Extract Tableau workbooks with projects and updated dates, excluding 'Archive'")
@@ -68,15 +384,65 @@ def main():
     parser.add_argument('--pat_name', required=True, help='Personal Access Token Name')
     parser.add_argument('--pat_secret', required=True, help='Personal Access Token Secret')
     parser.add_argument('--site_content_url', default='', help='Site content URL (leave empty for default site)')
-    parser.add_argument('--output_file', default='tableau_workbooks.xlsx', help='Output Excel file name')
+    parser.add_argument('--all-sites', dest='all_sites', action='store_true', help='Collect workbooks from every site on the server into one file with a Site column (requires a server administrator token)')
+    parser.add_argument('--format', dest='output_format', choices=sorted(SINKS), default='xlsx', help='Output format; csv, jsonl and parquet are written row by row as pages arrive')
+    parser.add_argument('--output_file', help='Output file name (default tableau_workbooks.<format>)')
+    parser.add_argument('--excel_file', help='Also convert the finished output to this Excel file')
+    parser.add_argument('--workers', type=int, default=1, help='Number of workbook pages to fetch concurrently per site')
+    parser.add_argument('--incremental', action='store_true', help='Only fetch workbooks updated since the last run and merge them into the existing output file (deleted or archived workbooks are only dropped by a full run)')
+    parser.add_argument('--state_file', default='tableau_workbooks.state.json', help='File that stores the last seen updatedAt for --incremental')
+    parser.add_argument('--refresh_times', action='store_true', help='Add last successful extract refresh time, duration and schedule columns (requires a site administrator token)')
+    parser.add_argument('--refresh_cache', default='tableau_refresh_cache.json', help='File that caches extract refresh jobs between runs for --refresh_times')
+    parser.add_argument('--max_requests_per_second', type=float, help='Cap on requests to the server across all workers (default unlimited)')
+    parser.add_argument('--retries', type=int, default=tabretry.MAX_RETRIES, help='Times to retry a request that was throttled (429), hit a 5xx error or lost its connection')
     
     args = parser.parse_args()
+    tabretry.configure(args.max_requests_per_second, max_retries=args.retries)
+    output_file = args.output_file or f"tableau_workbooks.{args.output_format}"
+    columns = (['Site'] if args.all_sites else []) + OUTPUT_COLUMNS + (REFRESH_COLUMNS if args.refresh_times else [])
+    
+    session = make_session(args.workers)
+    if args.all_sites:
+        auth_token, _ = sign_in(args.server_url, args.pat_name, args.pat_secret, '', session)
+        sites = get_all_sites(args.server_url, auth_token, session)
+        print(f"Found {len(sites)} sites")
+    else:
+        sites = [(args.site_content_url, None)]
+    state = load_state(args.state_file) if args.incremental else {}
+    previous = load_previous_output(output_file, args.output_format) if state else None
+    refresh_cache = load_state(args.refresh_cache) if args.refresh_times else {}
+    refreshes = {}
+    schedules = {}
+    
+    rows = iter_sites_workbooks(args, session, sites, state, previous is not None, refresh_cache, refreshes, schedules)
+    if previous is not None:
+        # The fetched delta is small, so it is held by Id while the previous output streams past it
+        rows = merge_workbooks(previous, {row['Id']: row for row in rows})
+    if args.refresh_times:
+        # Refreshes don't touch updatedAt, so every row is re-annotated, not just the fetched ones
+        rows = add_refresh_times(rows, refreshes, schedules)
     
-    auth_token, site_id = sign_in(args.server_url, args.pat_name, args.pat_secret, args.site_content_url)
-    data = get_all_workbooks(args.server_url, site_id, auth_token)
-    df = pd.DataFrame(data)
-    df.to_excel(args.output_file, index=False)
-    print(f"Data saved to {args.output_file}")
+    # Write next to the target and swap it in at the end, so the previous output stays readable while merging
+    root, ext = os.path.splitext(output_file)
+    temp_file = f"{root}.tmp{ext}"
+    sink = SINKS[args.output_format](temp_file, columns)
+    row_count = 0
+    try:
+        for row in rows:
+            sink.write(row)
+            row_count += 1
+    finally:
+        sink.close()
+    os.replace(temp_file, output_file)
+    print(f"Saved {row_count} workbooks to {output_file}")
+    if args.excel_file:
+        pd.DataFrame(iter_output_rows(output_file, args.output_format), columns=columns).to_excel(args.excel_file, index=False)
+        print(f"Data saved to {args.excel_file}")
+    if args.incremental:
+        save_state(args.state_file, state)
+    print(f"Server requests: {tabretry.STATS.summary()}")
+    if args.refresh_times:
+        save_state(args.refresh_cache, refresh_cache)
 
 if __name__ == "__main__":
     main()
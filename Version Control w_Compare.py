@@ -8,11 +8,35 @@ import re
 import logging
 import zipfile
 import shutil
+import gzip
+import hashlib
+import sqlite3
+import struct
+import tempfile
+import subprocess
+from contextlib import closing
 import ntpath
 import xml.etree.ElementTree as ET
-import sys
+import argparse
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import difflib
+from functools import partial, lru_cache
 from collections import defaultdict
-from typing import Dict, List, Set, Tuple, Any, Optional
+from typing import Dict, List, Set, Tuple, Any, Optional, NamedTuple
+
+import tabretry
+
+try:
+    # Optional. Only the tokenizer changes: both parsers feed the same Python-level PrunedTreeBuilder, so parsing
+    # takes about as long either way. lxml additionally refuses network access and entity expansion outright
+    from lxml import etree as lxml_etree
+    XML_PARSE_ERRORS = (ET.ParseError, lxml_etree.XMLSyntaxError)
+except ImportError:
+    lxml_etree = None
+    XML_PARSE_ERRORS = (ET.ParseError,)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,71 +53,310 @@ ALLOWED_PROJECTS = {'Test', 'My Reports'}
 # Update SAVE_DIR to your network path or a local path for testing
 SAVE_DIR = os.path.expanduser('~\Documents')
 
+# Pipeline sizing - downloads are network bound, extraction and comparison are disk/CPU bound
+DOWNLOAD_WORKERS = 4
+EXTRACT_WORKERS = 2
+COMPARE_PROCESSES = os.cpu_count() or 1 # Comparisons are CPU-bound Python, so they run in a process pool to use every core
+COMPARE_WORKERS = COMPARE_PROCESSES # Threads handing workbooks to that pool and writing their changelogs
+PIPELINE_QUEUE_SIZE = 8 # Workbooks allowed to wait between stages before the upstream stage blocks
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_REQUESTS_PER_SECOND = None # Shared by every download thread; None leaves requests unthrottled
+MAX_RETRIES = 5 # Per request, for throttling (429), 5xx and dropped connections, with backoff and Retry-After honoured
+PACKAGE_SPOOL_SIZE = 32 * 1024 * 1024 # Downloaded .twbx packages up to this size stay in memory; larger ones spill to local temp, never to SAVE_DIR
+REVISION_SNIFF_LIMIT = 1024 * 1024 # repository-location sits near the top of a .twb, so stop looking for it after this many bytes
+
+# Keep .twb revisions once each, gzip-compressed under their SHA-256 in SAVE_DIR/.revision_store,
+# with a {base}.manifest.json per workbook folder, instead of full dated copies
+USE_REVISION_STORE = False
+
+# Commit every new revision into a bare git repository, at <project>/<workbook>.twb, instead of keeping dated
+# copies; only the latest copy stays in the workbook folder, as the base for the next comparison.
+# Browse with e.g. git --git-dir <GIT_HISTORY_REPO> log -p -- "My Reports/Sales.twb"
+USE_GIT_HISTORY = False
+GIT_HISTORY_REPO = os.path.join(SAVE_DIR, 'workbook_history.git')
+GIT_HISTORY_BRANCH = 'refs/heads/main'
+GIT_EXECUTABLE = 'git'
+
+# Ask the server for each workbook's current revision number before downloading and skip the
+# download when it matches the revision recorded for the latest archived copy (and, for .twbx packages,
+# when updatedAt hasn't moved either, since extract refreshes don't create revisions)
+PRECHECK_REVISIONS = True
+
+# Each workbook's progress through a run is journaled in the revision index; a restarted run picks up every
+# workbook from its last completed step. Journal rows older than this are dropped at the start of a run
+JOURNAL_RETENTION_DAYS = 7
+
+# Formulas, custom and initial SQL, tables, servers and databases of every archived copy go into a full-text
+# index in the revision index, so --search can find which workbooks used them without reading the archive
+SEARCH_RESULT_LIMIT = 50
+SEARCH_COLUMNS = ('workbook', 'datasources', 'tables', 'servers', 'databases', 'custom_sql', 'initial_sql', 'formulas')
+
+# Attributes Tableau rewrites on save without a real change; they are left out of subtree hashes
+VOLATILE_ATTRIBUTES = {'id', 'uuid'}
+# Identifying attributes used to match child elements between two versions of a subtree
+CHILD_KEY_ATTRIBUTES = ('name', 'caption', 'column', 'field', 'param', 'datasource')
+MAX_STRUCTURAL_CHANGES = 25 # Per worksheet or dashboard, so one rebuilt view can't flood the changelog
+
+# Workbooks are parsed in chunks of PARSE_CHUNK_SIZE bytes. The contents of PRUNED_ELEMENTS and any element
+# text longer than MAX_TEXT_SIZE characters are kept only as a SHA-256 digest, so thumbnails and embedded
+# images never sit in memory but a change to them still changes the digest
+PARSE_CHUNK_SIZE = 1024 * 1024
+PRUNED_ELEMENTS = {'thumbnails'}
+MAX_TEXT_SIZE = 1024 * 1024
+
+# Calculated-field formulas are tokenized once per distinct text, and the tokens are compared with whitespace,
+# comments and keyword/function case ignored; only the edited tokens are reported
+FORMULA_CACHE_SIZE = 65536
+MAX_FORMULA_EDITS = 5 # Edits listed per changed formula before the rest are summarised
+MAX_FORMULA_SNIPPET = 80 # Characters shown per side of an edit
+
+FORMULA_TOKEN = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+  | (?P<space>\s+)
+  | (?P<field>\[(?:[^\]]|\]\])*\])
+  | (?P<string>'(?:[^']|'')*'|"(?:[^"]|"")*")
+  | (?P<date>\#[^#\n]*\#)
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+  | (?P<op><=|>=|<>|!=|==|.)
+""", re.VERBOSE | re.DOTALL)
+
+@lru_cache(maxsize=FORMULA_CACHE_SIZE)
+def formula_tokens(formula: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Split a formula into comparison keys and display text, dropping whitespace and comments."""
+    keys = []
+    texts = []
+    for match in FORMULA_TOKEN.finditer(formula):
+        kind = match.lastgroup
+        if kind in ('comment', 'space'):
+            continue
+        text = match.group()
+        # Functions and keywords are case-insensitive in Tableau; field names and literals are compared as written
+        keys.append(text.upper() if kind == 'word' else text)
+        texts.append(text)
+    return tuple(keys), tuple(texts)
+
+def render_tokens(texts) -> str:
+    rendered = ''
+    for text in texts:
+        if rendered and not rendered.endswith('(') and text not in (')', ','):
+            rendered += ' '
+        rendered += text
+    if len(rendered) > MAX_FORMULA_SNIPPET:
+        rendered = rendered[:MAX_FORMULA_SNIPPET - 3] + '...'
+    return rendered
+
+def describe_formula_edit(old_formula: str, new_formula: str) -> Optional[str]:
+    """Describe the token edits between two formulas, or return None if they only differ in layout."""
+    old_keys, old_texts = formula_tokens(old_formula)
+    new_keys, new_texts = formula_tokens(new_formula)
+    if old_keys == new_keys:
+        return None
+    edits = []
+    matcher = difflib.SequenceMatcher(None, old_keys, new_keys, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'replace':
+            edits.append(f'"{render_tokens(old_texts[i1:i2])}" -> "{render_tokens(new_texts[j1:j2])}"')
+        elif tag == 'delete':
+            edits.append(f'removed "{render_tokens(old_texts[i1:i2])}"')
+        elif tag == 'insert':
+            edits.append(f'added "{render_tokens(new_texts[j1:j2])}"')
+    if len(edits) > MAX_FORMULA_EDITS:
+        edits = edits[:MAX_FORMULA_EDITS] + [f"{len(edits) - MAX_FORMULA_EDITS} more edits"]
+    return '; '.join(edits)
+
+# Each workbook folder keeps changelog.jsonl, one comparison per line in the order they ran, and
+# changelog.idx, the byte offset of every line as a little-endian uint64, so the newest entries can
+# be read without scanning the log. Older changelog.txt files are left as they are.
+CHANGELOG_FILE = 'changelog.jsonl'
+CHANGELOG_INDEX_FILE = 'changelog.idx'
+
+class ColumnInfo(NamedTuple):
+    """One row of a datasource's keyed column table."""
+    datatype: Optional[str]
+    role: Optional[str]
+    type: Optional[str]
+    calculation_class: Optional[str]
+    calculation_hash: Optional[bytes]
+
+class PrunedTreeBuilder:
+    """Parser target that builds a workbook tree without holding on to large payloads."""
+    def __init__(self):
+        self.builder = ET.TreeBuilder()
+        self.pruned = None
+        self.pruned_depth = 0
+        self.pruned_digest = None
+        self.text_parts = []
+        self.text_size = 0
+        self.text_digest = None
+    
+    def start(self, tag, attrib):
+        if self.pruned_depth:
+            self.pruned_depth += 1
+            self.pruned_digest.update(f"<{tag} {sorted(attrib.items())}>".encode('utf-8'))
+            return None
+        self.flush_text()
+        elem = self.builder.start(tag, dict(attrib))
+        if tag in PRUNED_ELEMENTS:
+            self.pruned = elem
+            self.pruned_depth = 1
+            self.pruned_digest = hashlib.sha256()
+        return elem
+    
+    def data(self, data):
+        if self.pruned_depth:
+            self.pruned_digest.update(data.encode('utf-8'))
+        elif self.text_digest is not None:
+            self.text_digest.update(data.encode('utf-8'))
+        else:
+            self.text_parts.append(data)
+            self.text_size += len(data)
+            if self.text_size > MAX_TEXT_SIZE:
+                self.text_digest = hashlib.sha256(''.join(self.text_parts).encode('utf-8'))
+                self.text_parts = []
+    
+    def flush_text(self):
+        if self.text_digest is not None:
+            self.builder.data(f"sha256:{self.text_digest.hexdigest()}")
+        elif self.text_parts:
+            self.builder.data(''.join(self.text_parts))
+        self.text_parts = []
+        self.text_size = 0
+        self.text_digest = None
+    
+    def end(self, tag):
+        if self.pruned_depth:
+            self.pruned_depth -= 1
+            if self.pruned_depth:
+                self.pruned_digest.update(f"</{tag}>".encode('utf-8'))
+                return None
+            self.pruned.set('pruned-sha256', self.pruned_digest.hexdigest())
+            self.pruned = self.pruned_digest = None
+        self.flush_text()
+        return self.builder.end(tag)
+    
+    def close(self):
+        self.flush_text()
+        return self.builder.close()
+
 class TableauWorkbookComparator:
     def __init__(self):
         self.changes = defaultdict(list)
+        self.subtree_hashes = {}
+        self.indexes = None
         
     def parse_workbook(self, file_path: str) -> ET.Element:
-        """Parse a Tableau workbook XML file."""
+        """Parse a Tableau workbook XML file in chunks, leaving out thumbnails and other large payloads."""
+        target = PrunedTreeBuilder()
+        if lxml_etree is not None:
+            parser = lxml_etree.XMLParser(target=target, huge_tree=True, resolve_entities=False, no_network=True)
+        else:
+            parser = ET.XMLParser(target=target)
         try:
-            tree = ET.parse(file_path)
-            return tree.getroot()
-        except ET.ParseError as e:
+            with open_twb(file_path) as f:
+                for chunk in iter(partial(f.read, PARSE_CHUNK_SIZE), b''):
+                    parser.feed(chunk)
+            return parser.close()
+        except XML_PARSE_ERRORS as e:
             logger.error(f"Error parsing {file_path}: {e}")
             raise
         except FileNotFoundError:
             logger.error(f"File not found: {file_path}")
             raise
     
-    def extract_worksheets(self, root: ET.Element) -> Dict[str, ET.Element]:
-        """Extract all worksheets from the workbook."""
-        worksheets = {}
-        for worksheet in root.findall('.//worksheet'):
-            name = worksheet.get('name', 'Unnamed')
-            worksheets[name] = worksheet
-        return worksheets
+    def index_workbook(self, root: ET.Element) -> Dict[str, Any]:
+        """Walk the workbook once and collect every element the comparison steps read."""
+        index = {
+            'worksheets': {},
+            'dashboards': {},
+            'datasources': {},
+            'parameters': {},
+            'datasource_contents': {}
+        }
+        all_datasources = []
+        
+        def visit(elem, datasource_stack, connection_owners):
+            tag = elem.tag
+            if tag == 'worksheet':
+                index['worksheets'][elem.get('name', 'Unnamed')] = elem
+            elif tag == 'dashboard':
+                index['dashboards'][elem.get('name', 'Unnamed')] = elem
+            elif tag == 'datasource':
+                contents = {'connection': None, 'connection_relation': None, 'relations': [], 'columns': [], 'calculations': []}
+                index['datasource_contents'][elem] = contents
+                all_datasources.append(elem)
+                datasource_stack = datasource_stack + [contents]
+            elif tag == 'connection':
+                # Only the first connection in each datasource is described, as with datasource.find('.//connection')
+                owners = [contents for contents in datasource_stack if contents['connection'] is None]
+                for contents in owners:
+                    contents['connection'] = elem
+                connection_owners = connection_owners + owners
+            elif tag == 'relation':
+                for contents in datasource_stack:
+                    contents['relations'].append(elem)
+                for contents in connection_owners:
+                    if contents['connection_relation'] is None:
+                        contents['connection_relation'] = elem
+            elif tag == 'column':
+                calculation = elem.find('calculation')
+                for contents in datasource_stack:
+                    contents['columns'].append(elem)
+                    if calculation is not None:
+                        contents['calculations'].append((elem, calculation))
+            for child in elem:
+                visit(child, datasource_stack, connection_owners)
+        
+        for child in root:
+            visit(child, [], [])
+        
+        # Datasources directly under <datasources> win; embedded references only fill in missing keys
+        datasources_container = root.find('datasources')
+        top_level = datasources_container.findall('datasource') if datasources_container is not None else []
+        for datasource in top_level:
+            key = self.datasource_key(datasource)
+            if key and key != 'Parameters':
+                index['datasources'][key] = datasource
+        for datasource in all_datasources:
+            key = self.datasource_key(datasource)
+            if key and key != 'Parameters' and key not in index['datasources']:
+                index['datasources'][key] = datasource
+        
+        param_datasource = next((ds for ds in all_datasources if ds.get('name') == 'Parameters'), None)
+        if param_datasource is not None:
+            for param in index['datasource_contents'][param_datasource]['columns']:
+                if param.get('param') == 'true':
+                    index['parameters'][param.get('name', 'Unnamed')] = param
+        return index
     
-    def extract_dashboards(self, root: ET.Element) -> Dict[str, ET.Element]:
-        """Extract all dashboards from the workbook."""
-        dashboards = {}
-        for dashboard in root.findall('.//dashboard'):
-            name = dashboard.get('name', 'Unnamed')
-            dashboards[name] = dashboard
-        return dashboards
+    def datasource_key(self, datasource: ET.Element) -> str:
+        name = datasource.get('name', 'Unnamed')
+        caption = datasource.get('caption', name)
+        return caption if caption and caption != name else name
     
-    def extract_datasources(self, root: ET.Element) -> Dict[str, ET.Element]:
-        """Extract all datasources from the workbook."""
-        datasources = {}
-        datasources_container = root.find('datasources')
-        if datasources_container is not None:
-            for datasource in datasources_container.findall('datasource'):
-                name = datasource.get('name', 'Unnamed')
-                caption = datasource.get('caption', name)
-                key = caption if caption and caption != name else name
-                if key and key != 'Parameters':
-                    datasources[key] = datasource
-        for datasource in root.findall('.//datasource'):
-            name = datasource.get('name', 'Unnamed')
-            caption = datasource.get('caption', name)
-            key = caption if caption and caption != name else name
-            if key and key != 'Parameters' and key not in datasources:
-                datasources[key] = datasource
-        return datasources
+    def datasource_contents(self, datasource: ET.Element, index: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Return the indexed contents of a datasource, indexing it on its own if no workbook index is given."""
+        if index is not None and datasource in index['datasource_contents']:
+            return index['datasource_contents'][datasource]
+        wrapper = ET.Element('workbook')
+        wrapper.append(datasource)
+        return self.index_workbook(wrapper)['datasource_contents'][datasource]
     
-    def extract_datasource_details(self, datasource: ET.Element) -> Dict[str, Any]:
+    def extract_datasource_details(self, datasource: ET.Element, index: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Extract detailed information about a datasource."""
+        contents = self.datasource_contents(datasource, index)
         details = {
             'connection_type': None,
             'server': None,
             'database': None,
             'tables': [],
-            'columns': [],
+            'columns': {},
             'relations': [],
             'custom_sql': None,
             'initial_sql': None,
             'connection_attributes': {}
         }
-        connection = datasource.find('.//connection')
+        connection = contents['connection']
         if connection is not None:
             details['connection_type'] = connection.get('class')
             details['server'] = connection.get('server')
@@ -102,49 +365,42 @@ class TableauWorkbookComparator:
             details['connection_attributes'] = dict(connection.attrib)
             
             # Get custom SQL if present
-            relation = connection.find('.//relation')
+            relation = contents['connection_relation']
             if relation is not None and relation.get('type') == 'text':
                 details['custom_sql'] = relation.text
         
         # Get tables/relations
-        for relation in datasource.findall('.//relation'):
+        for relation in contents['relations']:
             if relation.get('table'):
                 details['tables'].append({
                     'name': relation.get('table'),
                     'type': relation.get('type', 'table')
                 })
         
-        # Get columns
-        for column in datasource.findall('.//column'):
-            col_info = {
-                'name': column.get('name'),
-                'datatype': column.get('datatype'),
-                'role': column.get('role'),
-                'type': column.get('type')
-            }
-            details['columns'].append(col_info)
+        # Get columns as a table keyed by name; the first definition of a name wins
+        calculations = dict(contents['calculations'])
+        columns = {}
+        for column in contents['columns']:
+            name = column.get('name')
+            datatype = column.get('datatype')
+            if not name or not datatype or name in columns:
+                continue
+            calculation = calculations.get(column)
+            columns[name] = ColumnInfo(
+                datatype, column.get('role'), column.get('type'),
+                calculation.get('class') if calculation is not None else None,
+                self.subtree_hash(calculation) if calculation is not None else None
+            )
+        details['columns'] = columns
         
         return details
     
-    def extract_parameters(self, root: ET.Element) -> Dict[str, ET.Element]:
-        """Extract all parameters from the workbook."""
-        parameters = {}
-        param_datasource = root.find('.//datasource[@name="Parameters"]')
-        if param_datasource is not None:
-            for param in param_datasource.findall('.//column[@param="true"]'):
-                name = param.get('name', 'Unnamed')
-                parameters[name] = param
-        return parameters
-    
-    def extract_calculated_fields(self, datasource: ET.Element) -> Dict[str, str]:
+    def extract_calculated_fields(self, datasource: ET.Element, index: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
         """Extract calculated fields from a datasource."""
         calc_fields = {}
-        for column in datasource.findall('.//column[@datatype]'):
-            name = column.get('caption', '')
-            calculation = column.find('calculation')
-            if calculation is not None and calculation.get('class') == 'tableau':
-                formula = calculation.get('formula', '')
-                calc_fields[name] = formula
+        for column, calculation in self.datasource_contents(datasource, index)['calculations']:
+            if column.get('datatype') is not None and calculation.get('class') == 'tableau':
+                calc_fields[column.get('caption', '')] = calculation.get('formula', '')
         return calc_fields
     
     def compare_sets(self, old_set: Set[str], new_set: Set[str], item_type: str):
@@ -158,16 +414,82 @@ class TableauWorkbookComparator:
     
     def compare_element_attributes(self, old_elem: ET.Element, new_elem: ET.Element, 
                                   elem_name: str, item_type: str):
-        """Compare attributes of XML elements."""
+        """Compare attributes of XML elements, leaving out the volatile ones Tableau rewrites on save."""
         old_attrs = old_elem.attrib
         new_attrs = new_elem.attrib
-        for attr_name in set(old_attrs.keys()) | set(new_attrs.keys()):
+        for attr_name in (set(old_attrs.keys()) | set(new_attrs.keys())) - VOLATILE_ATTRIBUTES:
             old_val = old_attrs.get(attr_name)
             new_val = new_attrs.get(attr_name)
             if old_val != new_val:
                 change_desc = f"{elem_name}: {attr_name} changed from '{old_val}' to '{new_val}'"
                 self.changes[f'{item_type}_modified'].append(change_desc)
     
+    def subtree_hash(self, elem: ET.Element) -> bytes:
+        """Hash an element's canonical form (sorted, non-volatile attributes, text, child hashes) bottom-up."""
+        digest = self.subtree_hashes.get(elem)
+        if digest is None:
+            h = hashlib.blake2b(digest_size=16)
+            h.update(elem.tag.encode('utf-8'))
+            for attr_name in sorted(elem.attrib):
+                if attr_name not in VOLATILE_ATTRIBUTES:
+                    h.update(f"\0{attr_name}={elem.attrib[attr_name]}".encode('utf-8'))
+            h.update(f"\1{(elem.text or '').strip()}".encode('utf-8'))
+            for child in elem:
+                h.update(self.subtree_hash(child))
+            digest = self.subtree_hashes[elem] = h.digest()
+        return digest
+    
+    def keyed_children(self, elem: ET.Element) -> Dict[str, ET.Element]:
+        """Label children by tag and identifying attribute, numbering repeats so every label is unique."""
+        children = {}
+        for child in elem:
+            ident = next((child.get(attr) for attr in CHILD_KEY_ATTRIBUTES if child.get(attr)), None)
+            label = f"{child.tag}[{ident}]" if ident else child.tag
+            occurrence = 1
+            unique_label = label
+            while unique_label in children:
+                occurrence += 1
+                unique_label = f"{label}#{occurrence}"
+            children[unique_label] = child
+        return children
+    
+    def diff_subtrees(self, old_elem: ET.Element, new_elem: ET.Element, path: str, found: List[str]):
+        """Describe how two differing subtrees differ, skipping child subtrees whose hashes match."""
+        if len(found) > MAX_STRUCTURAL_CHANGES:
+            return
+        old_children = self.keyed_children(old_elem)
+        new_children = self.keyed_children(new_elem)
+        for label in old_children:
+            if label not in new_children:
+                found.append(f"{path}/{label} removed")
+        for label in new_children:
+            if label not in old_children:
+                found.append(f"{path}/{label} added")
+        for label, old_child in old_children.items():
+            new_child = new_children.get(label)
+            if new_child is None or self.subtree_hash(old_child) == self.subtree_hash(new_child):
+                continue
+            child_path = f"{path}/{label}"
+            for attr_name in sorted(set(old_child.attrib) | set(new_child.attrib)):
+                old_val = old_child.get(attr_name)
+                new_val = new_child.get(attr_name)
+                if old_val != new_val and attr_name not in VOLATILE_ATTRIBUTES:
+                    found.append(f"{child_path}: {attr_name} changed from '{old_val}' to '{new_val}'")
+            if (old_child.text or '').strip() != (new_child.text or '').strip():
+                found.append(f"{child_path}: text changed")
+            self.diff_subtrees(old_child, new_child, child_path, found)
+    
+    def compare_structure(self, old_elem: ET.Element, new_elem: ET.Element, elem_name: str, item_type: str):
+        """Compare a worksheet or dashboard, descending only into subtrees whose hashes differ."""
+        if self.subtree_hash(old_elem) == self.subtree_hash(new_elem):
+            return
+        self.compare_element_attributes(old_elem, new_elem, elem_name, item_type)
+        found = []
+        self.diff_subtrees(old_elem, new_elem, elem_name, found)
+        if len(found) > MAX_STRUCTURAL_CHANGES:
+            found = found[:MAX_STRUCTURAL_CHANGES] + [f"{elem_name}: further structural changes not listed"]
+        self.changes[f'{item_type}_modified'].extend(found)
+    
     def compare_calculated_fields(self, old_fields: Dict[str, str], 
                                  new_fields: Dict[str, str], datasource_name: str):
         """Compare calculated fields between datasources."""
@@ -183,9 +505,12 @@ class TableauWorkbookComparator:
                 self.changes['calculated_fields_removed'].append(f"{datasource_name}: {field}")
         common_fields = old_field_names & new_field_names
         for field in common_fields:
-            if old_fields[field] != new_fields[field]:
+            if old_fields[field] == new_fields[field]:
+                continue
+            edit = describe_formula_edit(old_fields[field], new_fields[field])
+            if edit is not None:
                 self.changes['calculated_fields_modified'].append(
-                    f"{datasource_name}: {field} formula changed"
+                    f"{datasource_name}: {field} formula changed: {edit}"
                 )
     
     def compare_datasource_details(self, old_details: Dict[str, Any], 
@@ -231,51 +556,212 @@ class TableauWorkbookComparator:
             self.changes['datasource_tables_added'].append(f"{datasource_name}: {table}")
         for table in removed_tables:
             self.changes['datasource_tables_removed'].append(f"{datasource_name}: {table}")
-        old_columns = {(c['name'], c['datatype']) for c in old_details['columns'] if c['name'] and c['datatype']}
-        new_columns = {(c['name'], c['datatype']) for c in new_details['columns'] if c['name'] and c['datatype']}
-        added_columns = new_columns - old_columns
-        removed_columns = old_columns - new_columns
-        for name, datatype in added_columns:
-            self.changes['datasource_columns_added'].append(f"{datasource_name}: {name} ({datatype})")
-        for name, datatype in removed_columns:
-            self.changes['datasource_columns_removed'].append(f"{datasource_name}: {name} ({datatype})")
+        self.compare_columns(old_details['columns'], new_details['columns'], datasource_name)
+    
+    def compare_columns(self, old_columns: Dict[str, ColumnInfo], new_columns: Dict[str, ColumnInfo], datasource_name: str):
+        """Walk both column tables in name order once, recording added, removed and changed columns."""
+        for name in sorted(old_columns.keys() | new_columns.keys()):
+            old = old_columns.get(name)
+            new = new_columns.get(name)
+            if old == new:
+                continue
+            if old is None:
+                self.changes['datasource_columns_added'].append(f"{datasource_name}: {name} ({new.datatype})")
+                continue
+            if new is None:
+                self.changes['datasource_columns_removed'].append(f"{datasource_name}: {name} ({old.datatype})")
+                continue
+            described = [
+                f"{field} changed from '{getattr(old, field)}' to '{getattr(new, field)}'"
+                for field in ('datatype', 'role', 'type') if getattr(old, field) != getattr(new, field)
+            ]
+            # Formula edits in Tableau calculations are reported under calculated fields; this covers bins, groups and the like
+            if old.calculation_hash != new.calculation_hash and 'tableau' not in (old.calculation_class, new.calculation_class):
+                described.append("calculation changed")
+            if described:
+                self.changes['datasource_columns_modified'].append(f"{datasource_name}: {name} {', '.join(described)}")
+    
+    def formula_references(self, formula: str, datasource_name: str) -> List[str]:
+        """Qualified names ([datasource].[field]) of the fields a formula refers to."""
+        keys = formula_tokens(formula)[0]
+        references = []
+        i = 0
+        while i < len(keys):
+            if keys[i].startswith('['):
+                if i + 2 < len(keys) and keys[i + 1] == '.' and keys[i + 2].startswith('['):
+                    references.append(f"{keys[i]}.{keys[i + 2]}")
+                    i += 3
+                    continue
+                references.append(f"[{datasource_name}].{keys[i]}")
+            i += 1
+        return references
+    
+    def field_fingerprint(self, column: ET.Element, calculation: Optional[ET.Element]) -> str:
+        """Digest of what a field feeds into sheets: its type, parameter value and calculation."""
+        if calculation is not None and calculation.get('class') == 'tableau':
+            # Layout-only formula edits leave the fingerprint alone, as they do the changelog
+            content = '\0'.join(formula_tokens(calculation.get('formula', ''))[0])
+        elif calculation is not None:
+            content = self.subtree_hash(calculation).hex()
+        else:
+            content = ''
+        parts = [column.get(attr) or '' for attr in ('datatype', 'role', 'type', 'value')] + [content]
+        return hashlib.blake2b('\1'.join(parts).encode('utf-8'), digest_size=8).hexdigest()
+    
+    def dependency_subtrees(self, index: Dict[str, Any]) -> Dict[Tuple[str, str], ET.Element]:
+        """The datasources, worksheets and dashboards a dependency graph is built from, keyed by (kind, name)."""
+        subtrees = {}
+        datasources = list(index['datasources'].values())
+        datasources += [ds for ds in index['datasource_contents'] if ds.get('name') == 'Parameters']
+        for datasource in datasources:
+            subtrees.setdefault(('datasource', datasource.get('name', 'Unnamed')), datasource)
+        for name, worksheet in index['worksheets'].items():
+            subtrees[('worksheet', name)] = worksheet
+        for name, dashboard in index['dashboards'].items():
+            subtrees[('dashboard', name)] = dashboard
+        return subtrees
+    
+    def dependency_fragment(self, kind: str, elem: ET.Element, index: Dict[str, Any]) -> Dict[str, Any]:
+        """The nodes and edges one datasource, worksheet or dashboard adds to the dependency graph.
+
+        Fields are named [datasource].[field] as in formulas; edges run from a field to the calculations and
+        worksheets that use it, and from a worksheet to the dashboards that show it.
+        """
+        nodes = {}
+        edges = set()
+        if kind == 'datasource':
+            datasource_name = elem.get('name', 'Unnamed')
+            key = self.datasource_key(elem)
+            contents = self.datasource_contents(elem, index)
+            calculations = dict(contents['calculations'])
+            for column in contents['columns']:
+                name = column.get('name')
+                field = f"[{datasource_name}].{name}"
+                if not name or not column.get('datatype') or field in nodes:
+                    continue
+                calculation = calculations.get(column)
+                if column.get('param') == 'true':
+                    field_kind = 'parameter'
+                elif calculation is not None:
+                    field_kind = 'calculation'
+                else:
+                    field_kind = 'column'
+                label = f"{key}: {column.get('caption') or name.strip('[]')}"
+                nodes[field] = [field_kind, label, self.field_fingerprint(column, calculation)]
+                if calculation is not None and calculation.get('formula'):
+                    edges.update((reference, field) for reference in self.formula_references(calculation.get('formula'), datasource_name))
+        elif kind == 'worksheet':
+            sheet = f"worksheet:{elem.get('name', 'Unnamed')}"
+            nodes[sheet] = ['worksheet', elem.get('name', 'Unnamed'), None]
+            for dependencies in elem.iter('datasource-dependencies'):
+                datasource_name = dependencies.get('datasource')
+                for child in dependencies:
+                    name = child.get('name') if child.tag == 'column' else child.get('column') if child.tag == 'column-instance' else None
+                    if name:
+                        edges.add((f"[{datasource_name}].{name}", sheet))
+        else:
+            board = f"dashboard:{elem.get('name', 'Unnamed')}"
+            nodes[board] = ['dashboard', elem.get('name', 'Unnamed'), None]
+            for zone in elem.iter('zone'):
+                if zone.get('name'):
+                    edges.add((f"worksheet:{zone.get('name')}", board))
+        return {'nodes': nodes, 'edges': sorted(list(edge) for edge in edges)}
+    
+    def dependency_fragments(self, index: Dict[str, Any], known: Optional[Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]]] = None
+                             ) -> Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]]:
+        """Build a workbook's dependency graph as one fragment per subtree, with the subtree hash it was built from.
+
+        Fragments in `known` (usually the previous revision's) whose subtree hash still matches are reused, so
+        only datasources, worksheets and dashboards that changed are walked.
+        """
+        fragments = {}
+        for (kind, name), elem in self.dependency_subtrees(index).items():
+            digest = self.subtree_hash(elem).hex()
+            previous = (known or {}).get((kind, name))
+            if previous is not None and previous[0] == digest:
+                fragments[(kind, name)] = previous
+            else:
+                fragments[(kind, name)] = (digest, self.dependency_fragment(kind, elem, index))
+        return fragments
+    
+    def dependency_graph(self, fragments: Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]]):
+        """Join fragments into a node table and a map from each node to the nodes that use it."""
+        nodes = {}
+        downstream = defaultdict(set)
+        for _, fragment in fragments.values():
+            nodes.update(fragment['nodes'])
+            for upstream, node in fragment['edges']:
+                downstream[upstream].add(node)
+        return nodes, downstream
+    
+    def change_impact(self, old_fragments, new_fragments) -> Dict[str, Dict[str, List[str]]]:
+        """List the worksheets and dashboards each removed or changed field reaches, directly or through calculations."""
+        old_nodes, old_downstream = self.dependency_graph(old_fragments)
+        new_nodes, new_downstream = self.dependency_graph(new_fragments)
+        impact = {}
+        for field, (kind, label, fingerprint) in sorted(old_nodes.items()):
+            if kind in ('worksheet', 'dashboard'):
+                continue
+            new = new_nodes.get(field)
+            if new is not None and new[2] == fingerprint:
+                continue
+            # A removed field breaks what used it before; a changed one affects what uses it now
+            nodes, downstream = (old_nodes, old_downstream) if new is None else (new_nodes, new_downstream)
+            reached = set()
+            pending = [field]
+            while pending:
+                for node in downstream.get(pending.pop(), ()):
+                    if node not in reached:
+                        reached.add(node)
+                        pending.append(node)
+            sheets = {}
+            for sheet_kind, heading in (('worksheet', 'worksheets'), ('dashboard', 'dashboards')):
+                names = sorted(nodes[node][1] for node in reached if node in nodes and nodes[node][0] == sheet_kind)
+                if names:
+                    sheets[heading] = names
+            if sheets:
+                impact[new[1] if new is not None else label] = sheets
+        return impact
     
     def compare_workbooks(self, old_file: str, new_file: str) -> Dict[str, List[str]]:
         """Main comparison function."""
         logger.info(f"Comparing {old_file} with {new_file}")
-        old_root = self.parse_workbook(old_file)
-        new_root = self.parse_workbook(new_file)
-        old_worksheets = self.extract_worksheets(old_root)
-        new_worksheets = self.extract_worksheets(new_root)
-        old_dashboards = self.extract_dashboards(old_root)
-        new_dashboards = self.extract_dashboards(new_root)
-        old_datasources = self.extract_datasources(old_root)
-        new_datasources = self.extract_datasources(new_root)
-        old_parameters = self.extract_parameters(old_root)
-        new_parameters = self.extract_parameters(new_root)
+        old_index = self.index_workbook(self.parse_workbook(old_file))
+        new_index = self.index_workbook(self.parse_workbook(new_file))
+        self.indexes = (old_index, new_index)
+        old_worksheets = old_index['worksheets']
+        new_worksheets = new_index['worksheets']
+        old_dashboards = old_index['dashboards']
+        new_dashboards = new_index['dashboards']
+        old_datasources = old_index['datasources']
+        new_datasources = new_index['datasources']
+        old_parameters = old_index['parameters']
+        new_parameters = new_index['parameters']
         self.compare_sets(set(old_worksheets.keys()), set(new_worksheets.keys()), 'worksheets')
         common_worksheets = set(old_worksheets.keys()) & set(new_worksheets.keys())
         for ws_name in common_worksheets:
             old_ws = old_worksheets[ws_name]
             new_ws = new_worksheets[ws_name]
-            self.compare_element_attributes(old_ws, new_ws, ws_name, 'worksheets')
+            self.compare_structure(old_ws, new_ws, ws_name, 'worksheets')
         self.compare_sets(set(old_dashboards.keys()), set(new_dashboards.keys()), 'dashboards')
         common_dashboards = set(old_dashboards.keys()) & set(new_dashboards.keys())
         for db_name in common_dashboards:
             old_db = old_dashboards[db_name]
             new_db = new_dashboards[db_name]
-            self.compare_element_attributes(old_db, new_db, db_name, 'dashboards')
+            self.compare_structure(old_db, new_db, db_name, 'dashboards')
         self.compare_sets(set(old_datasources.keys()), set(new_datasources.keys()), 'datasources')
         common_datasources = set(old_datasources.keys()) & set(new_datasources.keys())
         for ds_name in common_datasources:
             old_ds = old_datasources[ds_name]
             new_ds = new_datasources[ds_name]
+            if self.subtree_hash(old_ds) == self.subtree_hash(new_ds):
+                continue
             self.compare_element_attributes(old_ds, new_ds, ds_name, 'datasources')
-            old_ds_details = self.extract_datasource_details(old_ds)
-            new_ds_details = self.extract_datasource_details(new_ds)
+            old_ds_details = self.extract_datasource_details(old_ds, old_index)
+            new_ds_details = self.extract_datasource_details(new_ds, new_index)
             self.compare_datasource_details(old_ds_details, new_ds_details, ds_name)
-            old_calc_fields = self.extract_calculated_fields(old_ds)
-            new_calc_fields = self.extract_calculated_fields(new_ds)
+            old_calc_fields = self.extract_calculated_fields(old_ds, old_index)
+            new_calc_fields = self.extract_calculated_fields(new_ds, new_index)
             self.compare_calculated_fields(old_calc_fields, new_calc_fields, ds_name)
         self.compare_sets(set(old_parameters.keys()), set(new_parameters.keys()), 'parameters')
         common_parameters = set(old_parameters.keys()) & set(new_parameters.keys())
@@ -285,13 +771,13 @@ class TableauWorkbookComparator:
             self.compare_element_attributes(old_param, new_param, param_name, 'parameters')
         return dict(self.changes)
     
-    def print_summary(self, changes: Dict[str, List[str]]):
-        """Print a formatted summary of changes."""
-        print("\n" + "="*60)
-        print("TABLEAU WORKBOOK COMPARISON SUMMARY")
-        print("="*60)
+    def print_summary(self, changes: Dict[str, List[str]], file=None, impact=None):
+        """Print a formatted summary of changes, and the sheets changed fields reach, to stdout or the given file."""
+        print("\n" + "="*60, file=file)
+        print("TABLEAU WORKBOOK COMPARISON SUMMARY", file=file)
+        print("="*60, file=file)
         if not any(changes.values()):
-            print("No changes detected between the workbooks.")
+            print("No changes detected between the workbooks.", file=file)
             return
         change_types = [
             ('worksheets_added', 'Worksheets Added'),
@@ -314,21 +800,30 @@ class TableauWorkbookComparator:
             ('datasource_tables_removed', 'Data Source Tables Removed'),
             ('datasource_columns_added', 'Data Source Columns Added'),
             ('datasource_columns_removed', 'Data Source Columns Removed'),
+            ('datasource_columns_modified', 'Data Source Columns Modified'),
             ('calculated_fields_added', 'Calculated Fields Added'),
             ('calculated_fields_removed', 'Calculated Fields Removed'),
             ('calculated_fields_modified', 'Calculated Fields Modified'),
             ('parameters_added', 'Parameters Added'),
             ('parameters_removed', 'Parameters Removed'),
-            ('parameters_modified', 'Parameters Modified')
+            ('parameters_modified', 'Parameters Modified'),
+            ('package_assets_added', 'Packaged Files Added'),
+            ('package_assets_removed', 'Packaged Files Removed'),
+            ('package_assets_modified', 'Packaged Files Modified')
         ]
         for change_key, display_name in change_types:
             if change_key in changes and changes[change_key]:
-                print(f"\n{display_name}:")
+                print(f"\n{display_name}:", file=file)
                 for item in changes[change_key]:
-                    print(f"  • {item}")
+                    print(f"  • {item}", file=file)
+        if impact:
+            print("\nImpacted Sheets:", file=file)
+            for field, sheets in impact.items():
+                reached = '; '.join(f"{heading} {', '.join(sheets[heading])}" for heading in ('worksheets', 'dashboards') if heading in sheets)
+                print(f"  • {field} -> {reached}", file=file)
         total_changes = sum(len(items) for items in changes.values())
-        print(f"\nTotal Changes: {total_changes}")
-        print("="*60)
+        print(f"\nTotal Changes: {total_changes}", file=file)
+        print("="*60, file=file)
 
 def sign_in(server, api_version, token_name, token_secret, site_content_url):
     try:
@@ -344,7 +839,7 @@ def sign_in(server, api_version, token_name, token_secret, site_content_url):
         req.add_header('Content-Type', 'application/json')
         req.add_header('Accept', 'application/json')
         logger.info(f"Signing in to {url}")
-        with urllib.request.urlopen(req) as response:
+        with tabretry.urlopen(req) as response:
             data = json.loads(response.read().decode('utf-8'))
             token = data['credentials']['token']
             site_id = data['credentials']['site']['id']
@@ -376,7 +871,7 @@ def get_all_workbooks(server, api_version, site_id, token):
             req = urllib.request.Request(url)
             req.add_header('Accept', 'application/json')
             req.add_header('X-Tableau-Auth', token)
-            with urllib.request.urlopen(req) as response:
+            with tabretry.urlopen(req) as response:
                 data = json.loads(response.read().decode('utf-8'))
                 logger.debug(f"API response: {json.dumps(data, indent=2)}")
                 wb_list = data.get('workbooks', {}).get('workbook', []) if isinstance(data.get('workbooks'), dict) else data.get('workbooks', [])
@@ -419,6 +914,48 @@ def get_all_workbooks(server, api_version, site_id, token):
         logger.error(f"Unexpected error fetching workbooks: {e}")
         raise
 
+def get_server_revision(server, api_version, site_id, token, wb_id):
+    """Return the workbook's current revision number, or None if the server keeps no revision history."""
+    try:
+        latest = None
+        page_number = 1
+        page_size = 100
+        while True:
+            url = f"{server}/api/{api_version}/sites/{site_id}/workbooks/{wb_id}/revisions?pageSize={page_size}&pageNumber={page_number}"
+            req = urllib.request.Request(url)
+            req.add_header('Accept', 'application/json')
+            req.add_header('X-Tableau-Auth', token)
+            with tabretry.urlopen(req) as response:
+                data = json.loads(response.read().decode('utf-8'))
+            revisions = data.get('revisions', {}).get('revision', [])
+            for revision in revisions:
+                number = int(revision.get('revisionNumber', 0))
+                if latest is None or number > latest:
+                    latest = number
+            total = int(data.get('pagination', {}).get('totalAvailable', 0))
+            if page_number * page_size >= total:
+                return str(latest) if latest is not None else None
+            page_number += 1
+    except urllib.error.HTTPError as e:
+        if e.code in (403, 404):
+            logger.info(f"Revision history unavailable for workbook {wb_id} ({e.code}); it will be downloaded")
+            return None
+        logger.error(f"HTTP error fetching revisions for workbook {wb_id}: {e.code} {e.reason}")
+        raise
+    except urllib.error.URLError as e:
+        logger.error(f"URL error fetching revisions for workbook {wb_id}: {e.reason}")
+        raise
+
+def load_server_revision(wb_id) -> Optional[sqlite3.Row]:
+    """Server revision number, updatedAt and file type recorded for a workbook's latest archived copy."""
+    with closing(open_index()) as conn:
+        return conn.execute('SELECT revision, updated_at, ext FROM server_revisions WHERE workbook_id = ?', (wb_id,)).fetchone()
+
+def record_server_revision(wb_id, revision, updated_at=None, ext=None):
+    with closing(open_index()) as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO server_revisions (workbook_id, revision, updated_at, ext) VALUES (?, ?, ?, ?)',
+                     (wb_id, revision, updated_at, ext))
+
 def add_long_path_prefix(path):
     """Add appropriate long path prefix for Windows paths."""
     if os.name != 'nt':
@@ -440,7 +977,7 @@ def download_workbook(server, api_version, site_id, token, wb_id, updated_at, wb
         logger.info(f"Downloading workbook {wb_name} from {url}")
         req = urllib.request.Request(url)
         req.add_header('X-Tableau-Auth', token)
-        with urllib.request.urlopen(req) as response:
+        with tabretry.urlopen(req) as response:
             headers = response.headers
             content_disp = headers['Content-Disposition']
             if not content_disp:
@@ -453,11 +990,18 @@ def download_workbook(server, api_version, site_id, token, wb_id, updated_at, wb
             base = re.sub(r'[^\w\-]', '_', wb_name)
             new_filename = f"{base}_{mod_date}{ext}"
             save_path = os.path.join(wb_folder, new_filename)
+            if ext.lower() == '.twbx':
+                # The package is only read once to pull out the .twb, so it never needs to touch the share
+                package = tempfile.SpooledTemporaryFile(max_size=PACKAGE_SPOOL_SIZE)
+                shutil.copyfileobj(response, package, DOWNLOAD_CHUNK_SIZE)
+                package.seek(0)
+                logger.info(f"Downloaded workbook package {wb_name} ({new_filename})")
+                return base, ext, new_filename, wb_folder, package
+            # Stream the body straight into the archive rather than buffering the whole workbook in memory
             logger.debug(f"Saving workbook to: {save_path}")
-            with open(save_path, 'wb') as f:
-                f.write(response.read())
+            archive_twb(response, wb_folder, base, new_filename)
             logger.info(f"Downloaded workbook {wb_name} to {save_path}")
-            return base, ext, new_filename, wb_folder
+            return base, ext, new_filename, wb_folder, None
     except urllib.error.HTTPError as e:
         logger.error(f"HTTP error downloading workbook {wb_name}: {e.code} {e.reason}")
         raise
@@ -471,58 +1015,708 @@ def download_workbook(server, api_version, site_id, token, wb_id, updated_at, wb
         logger.error(f"Unexpected error downloading workbook {wb_name}: {e}")
         raise
 
-def extract_twbx(twbx_path, wb_folder, base, mod_date):
+def extract_twbx(package, wb_folder, base, mod_date):
+    """Archive the .twb inside a .twbx, given as a path or an open file, without unpacking anything else."""
     try:
+        label = package if isinstance(package, str) else f"{base} package"
         wb_folder = add_long_path_prefix(wb_folder) if not wb_folder.startswith('\\\\?\\') else wb_folder
-        extract_path = os.path.join(wb_folder, "extracted")
-        os.makedirs(extract_path, exist_ok=True)
         twb_files = []
-        with zipfile.ZipFile(twbx_path, 'r') as zip_ref:
-            logger.info(f"Inspecting contents of {twbx_path}")
+        with zipfile.ZipFile(package, 'r') as zip_ref:
+            logger.info(f"Inspecting contents of {label}")
+            fingerprints = package_fingerprints(zip_ref)
             zip_contents = zip_ref.namelist()
             logger.debug(f"ZIP contents: {zip_contents}")
             for item in zip_contents:
                 if item.endswith('.twb'):
                     sanitized_base = re.sub(r'[^\w\-]', '_', base)
                     dest_filename = f"{sanitized_base}_{mod_date}.twb"
-                    dest_path = os.path.join(wb_folder, dest_filename)
-                    logger.debug(f"Extracting .twb file to: {dest_path}")
-                    with zip_ref.open(item) as source, open(dest_path, 'wb') as target:
-                        shutil.copyfileobj(source, target)
+                    logger.debug(f"Extracting .twb file to: {os.path.join(wb_folder, dest_filename)}")
+                    with zip_ref.open(item) as source:
+                        dest_path = archive_twb(source, wb_folder, sanitized_base, dest_filename)
+                    record_package_assets(dest_path, fingerprints)
                     twb_files.append(dest_path)
-                    logger.info(f"Extracted and moved .twb file to: {dest_path}")
+                    logger.info(f"Extracted .twb file to: {dest_path}")
                 else:
                     logger.debug(f"Skipping non-.twb file in archive: {item}")
-        if os.path.exists(extract_path):
-            shutil.rmtree(extract_path)
-            logger.info(f"Deleted extracted folder: {extract_path}")
         if not twb_files:
-            logger.warning(f"No .twb files found in {twbx_path}")
+            logger.warning(f"No .twb files found in {label}")
         return twb_files
     except zipfile.BadZipFile as e:
-        logger.error(f"Failed to extract {twbx_path}: Invalid ZIP file: {e}")
+        logger.error(f"Failed to extract {label}: Invalid ZIP file: {e}")
         raise
     except OSError as e:
-        logger.error(f"OS error extracting {twbx_path}: {e}")
+        logger.error(f"OS error extracting {label}: {e}")
         raise
     except Exception as e:
-        logger.error(f"Error extracting {twbx_path}: {e}")
+        logger.error(f"Error extracting {label}: {e}")
         raise
 
-def manage_copies(base, ext, wb_folder):
+def store_dir():
+    return os.path.join(SAVE_DIR, '.revision_store')
+
+def blob_path(digest):
+    return os.path.join(store_dir(), 'objects', digest[:2], f"{digest[2:]}.twb.gz")
+
+def hash_file(path):
+    sha = hashlib.sha256()
+    size = 0
+    with open_twb(path) as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+            sha.update(chunk)
+            size += len(chunk)
+    return sha.hexdigest(), size
+
+def store_blob(path, digest=None, size=None):
+    """Add a file to the revision store under its SHA-256 and return (digest, size)."""
+    if digest is None:
+        digest, size = hash_file(path)
+    target = blob_path(digest)
+    with _store_lock:
+        if os.path.exists(target):
+            logger.debug(f"Revision store already holds {digest}")
+            return digest, size
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Compress to a temporary name and move it into place so a concurrent writer of the same content can't see a partial blob
+    temp_target = f"{target}.{threading.get_ident()}.tmp"
+    with open(path, 'rb') as source, gzip.open(temp_target, 'wb') as dest:
+        shutil.copyfileobj(source, dest, DOWNLOAD_CHUNK_SIZE)
+    os.replace(temp_target, target)
+    logger.info(f"Stored {os.path.basename(path)} as {digest}")
+    return digest, size
+
+# Held while a blob is checked for or written and while an unreferenced one is deleted, so a copy that is
+# just being stored can't lose its blob to a concurrent removal of other copies with the same content
+_store_lock = threading.Lock()
+_unrecorded_blobs = defaultdict(int) # Blobs written by archive_twb whose copy isn't in the index yet
+_store_backfilled = set()
+
+def backfill_store_references():
+    """Index every workbook folder with a manifest, once per run, so the index knows every reference into the store."""
+    if SAVE_DIR in _store_backfilled:
+        return
+    with closing(open_index()) as conn:
+        indexed = {(row['folder'], row['base']) for row in conn.execute('SELECT folder, base FROM indexed_folders')}
+    for path in glob.glob(os.path.join(SAVE_DIR, '**', '*.manifest.json'), recursive=True):
+        wb_folder, name = os.path.split(path)
+        base = name[:-len('.manifest.json')]
+        if (wb_folder, base) not in indexed:
+            backfill_index(base, wb_folder)
+    _store_backfilled.add(SAVE_DIR)
+
+def release_blob(digest):
+    """Delete a blob from the revision store once no archived copy, in any workbook folder, refers to it."""
+    backfill_store_references()
+    with _store_lock:
+        if _unrecorded_blobs.get(digest):
+            return
+        with closing(open_index()) as conn:
+            if conn.execute('SELECT 1 FROM archived_files WHERE sha256 = ? LIMIT 1', (digest,)).fetchone():
+                return
+        try:
+            os.remove(blob_path(digest))
+        except FileNotFoundError:
+            return
+    logger.info(f"Removed {digest} from the revision store; no archived copy refers to it any more")
+
+def manifest_path(base, wb_folder):
+    return os.path.join(wb_folder, f"{base}.manifest.json")
+
+def load_manifest(base, wb_folder) -> Dict[str, Dict[str, Any]]:
+    """Map each archived file name of a workbook to its revision store entry."""
+    try:
+        with open(manifest_path(base, wb_folder), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_manifest(base, wb_folder, manifest):
+    path = manifest_path(base, wb_folder)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(f"{path}.tmp", path)
+
+def manifest_entry(path) -> Optional[Dict[str, Any]]:
+    # Archived names are {base}_{YYYY-MM-DD}.twb, so the base is everything before the last underscore
+    name = os.path.basename(path)
+    base = name.rsplit('_', 1)[0]
+    return load_manifest(base, os.path.dirname(path)).get(name)
+
+def open_twb(path):
+    """Open an archived .twb by its usual name, whether it is a plain file or held in the revision store."""
+    if os.path.exists(path):
+        return open(path, 'rb')
+    entry = manifest_entry(path)
+    if entry is None:
+        raise FileNotFoundError(f"No such file or revision store entry: {path}")
+    return gzip.open(blob_path(entry['blob']), 'rb')
+
+def read_twb_revision(path):
+    """Read repository-location/@revision, stopping as soon as it has been seen."""
+    with open_twb(path) as f:
+        for _, elem in ET.iterparse(f, events=('start',)):
+            if elem.tag == 'repository-location':
+                return elem.get('revision')
+    return None
+
+def ingest_loose_copies(base, wb_folder):
+    """Move freshly extracted {base}_*.twb files into the revision store."""
+    loose_files = glob.glob(os.path.join(wb_folder, f"{base}_*.twb"))
+    if not loose_files:
+        return
+    manifest = load_manifest(base, wb_folder)
+    for fn in loose_files:
+        entry = indexed_file(fn) or record_archived_file(fn, base)
+        digest, size = store_blob(fn, entry['sha256'], entry['size'])
+        replaced = manifest.get(os.path.basename(fn))
+        manifest[os.path.basename(fn)] = {'blob': digest, 'size': size, 'revision': entry['revision']}
+        save_manifest(base, wb_folder, manifest)
+        os.remove(fn)
+        if replaced is not None and replaced['blob'] != digest:
+            release_blob(replaced['blob'])
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS archived_files (
+    folder TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    base TEXT NOT NULL,
+    archived_date TEXT,
+    revision TEXT,
+    size INTEGER,
+    sha256 TEXT,
+    recorded_at TEXT,
+    PRIMARY KEY (folder, file_name)
+);
+CREATE INDEX IF NOT EXISTS archived_files_base ON archived_files (folder, base);
+CREATE TABLE IF NOT EXISTS indexed_folders (
+    folder TEXT NOT NULL,
+    base TEXT NOT NULL,
+    PRIMARY KEY (folder, base)
+);
+CREATE TABLE IF NOT EXISTS server_revisions (
+    workbook_id TEXT PRIMARY KEY,
+    revision TEXT,
+    updated_at TEXT,
+    ext TEXT
+);
+CREATE TABLE IF NOT EXISTS package_assets (
+    folder TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    asset TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    crc32 INTEGER NOT NULL,
+    PRIMARY KEY (folder, file_name, asset)
+);
+CREATE TABLE IF NOT EXISTS dependency_fragments (
+    folder TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    subtree_hash TEXT NOT NULL,
+    fragment TEXT NOT NULL,
+    PRIMARY KEY (folder, file_name, kind, name)
+);
+CREATE TABLE IF NOT EXISTS search_documents (
+    doc_id INTEGER PRIMARY KEY,
+    folder TEXT NOT NULL,
+    file_name TEXT NOT NULL,
+    base TEXT NOT NULL,
+    revision TEXT,
+    archived_date TEXT,
+    sha256 TEXT,
+    UNIQUE (folder, file_name, sha256)
+);
+CREATE TABLE IF NOT EXISTS run_journal (
+    workbook_id TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    state TEXT NOT NULL,
+    base TEXT,
+    ext TEXT,
+    wb_folder TEXT,
+    server_revision TEXT,
+    changed_at TEXT NOT NULL,
+    PRIMARY KEY (workbook_id, updated_at)
+);
+"""
+
+# Rows are keyed by search_documents.doc_id, one per archived content (a same-day republish overwrites the
+# copy but adds a document), so a revision stays searchable after its copy is replaced or removed
+SEARCH_SCHEMA = f"CREATE VIRTUAL TABLE IF NOT EXISTS history_search USING fts5({', '.join(SEARCH_COLUMNS)})"
+
+_index_lock = threading.Lock()
+_index_ready = set()
+
+def index_path():
+    return os.path.join(SAVE_DIR, 'revision_index.sqlite')
+
+def open_index():
+    """Open the SQLite revision index under SAVE_DIR, creating its tables on first use."""
+    path = index_path()
+    conn = sqlite3.connect(path, timeout=60)
+    conn.row_factory = sqlite3.Row
+    with _index_lock:
+        if path not in _index_ready:
+            # SAVE_DIR is often a network share, where WAL doesn't work; keep the rollback journal (switching back any
+            # index an earlier version put in WAL mode) and let the busy timeout serialise the threads
+            conn.execute('PRAGMA journal_mode=DELETE')
+            conn.executescript(INDEX_SCHEMA)
+            try:
+                conn.execute(SEARCH_SCHEMA)
+            except sqlite3.OperationalError as e:
+                # SQLite builds without FTS5 still archive and compare; only --search is unavailable
+                logger.warning(f"Search index unavailable: {e}")
+            # Indexes created before updatedAt and the file type were recorded get the columns added
+            recorded = {row['name'] for row in conn.execute('PRAGMA table_info(server_revisions)')}
+            for column in ('updated_at', 'ext'):
+                if column not in recorded:
+                    conn.execute(f'ALTER TABLE server_revisions ADD COLUMN {column} TEXT')
+            # server_revisions.json predates the index; fold it in once
+            legacy_path = os.path.join(SAVE_DIR, 'server_revisions.json')
+            if os.path.exists(legacy_path):
+                with open(legacy_path, 'r') as f:
+                    conn.executemany('INSERT OR IGNORE INTO server_revisions (workbook_id, revision) VALUES (?, ?)', json.load(f).items())
+                conn.commit()
+                os.replace(legacy_path, f"{legacy_path}.imported")
+            _index_ready.add(path)
+    return conn
+
+def remove_long_path_prefix(path):
+    return path.replace('\\\\?\\UNC\\', '\\\\').replace('\\\\?\\', '') if path.startswith('\\\\?\\') else path
+
+def archive_date(base, file_name):
+    """Parse the date out of a {base}_{date}.twb name, or return None if it isn't one."""
+    date_str = os.path.splitext(file_name)[0][len(base) + 1:].replace('_', '-')
+    try:
+        return datetime.fromisoformat(date_str).date().isoformat()
+    except ValueError:
+        return None
+
+def copy_and_hash(source, target):
+    """Stream source into target and return the SHA-256 and size written, plus the workbook revision seen on the way."""
+    sha = hashlib.sha256()
+    size = 0
+    parser = ET.XMLPullParser(events=('start',))
+    revision = None
+    sniffing = True
+    for chunk in iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b''):
+        sha.update(chunk)
+        size += len(chunk)
+        target.write(chunk)
+        if sniffing:
+            try:
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.tag == 'repository-location':
+                        revision = elem.get('revision')
+                        sniffing = False
+                        break
+            except ET.ParseError:
+                sniffing = False
+            if size >= REVISION_SNIFF_LIMIT:
+                sniffing = False
+    return sha.hexdigest(), size, revision
+
+def write_blob(source):
+    """Compress a .twb stream into the revision store in one pass and return (digest, size, revision)."""
+    objects_dir = os.path.join(store_dir(), 'objects')
+    os.makedirs(objects_dir, exist_ok=True)
+    temp_target = os.path.join(objects_dir, f"incoming.{threading.get_ident()}.tmp")
+    with open(temp_target, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as target:
+        digest, size, revision = copy_and_hash(source, target)
+    target_path = blob_path(digest)
+    with _store_lock:
+        # The caller records the copy in the index and then calls done_with_blob; until then the blob is kept
+        _unrecorded_blobs[digest] += 1
+        if os.path.exists(target_path):
+            os.remove(temp_target)
+        else:
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            os.replace(temp_target, target_path)
+            logger.info(f"Stored revision as {digest}")
+    return digest, size, revision
+
+def done_with_blob(digest):
+    with _store_lock:
+        _unrecorded_blobs[digest] -= 1
+        if not _unrecorded_blobs[digest]:
+            del _unrecorded_blobs[digest]
+
+def archive_twb(source, wb_folder, base, file_name):
+    """Write a .twb stream straight to its archived form, on disk or in the revision store, and index it."""
+    dest_path = os.path.join(wb_folder, file_name)
+    if USE_REVISION_STORE:
+        digest, size, revision = write_blob(source)
+        manifest = load_manifest(base, wb_folder)
+        replaced = manifest.get(file_name)
+        manifest[file_name] = {'blob': digest, 'size': size, 'revision': revision}
+        save_manifest(base, wb_folder, manifest)
+    else:
+        # Written under a .part name and renamed when complete, so an interrupted run never leaves a truncated copy
+        for partial_file in glob.glob(os.path.join(glob.escape(wb_folder), f"{glob.escape(base)}_*.part")):
+            logger.warning(f"Removing partial file left by an interrupted run: {partial_file}")
+            os.remove(partial_file)
+        with open(f"{dest_path}.part", 'wb') as target:
+            digest, size, revision = copy_and_hash(source, target)
+        os.replace(f"{dest_path}.part", dest_path)
+    try:
+        entry = record_archived_file(dest_path, base, digest, size, revision)
+    finally:
+        if USE_REVISION_STORE:
+            done_with_blob(digest)
+    if USE_REVISION_STORE:
+        if revision is None and entry['revision'] is not None:
+            manifest[file_name]['revision'] = entry['revision']
+            save_manifest(base, wb_folder, manifest)
+        # A same-day republish replaces the day's copy, and with it possibly the last reference to the old blob
+        if replaced is not None and replaced['blob'] != digest:
+            release_blob(replaced['blob'])
+    return dest_path
+
+def record_archived_file(path, base, sha256=None, size=None, revision=None) -> Dict[str, Any]:
+    """Record an archived .twb in the index; anything not supplied is read from the file once, here."""
+    if sha256 is None:
+        sha256, size = hash_file(path)
+    if revision is None:
+        revision = read_twb_revision(path)
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    entry = {
+        'folder': folder,
+        'file_name': file_name,
+        'base': base,
+        'archived_date': archive_date(base, file_name),
+        'revision': revision,
+        'size': size,
+        'sha256': sha256,
+        'recorded_at': datetime.now().isoformat(timespec='seconds')
+    }
+    with closing(open_index()) as conn, conn:
+        conn.execute('INSERT OR REPLACE INTO archived_files (folder, file_name, base, archived_date, revision, size, sha256, recorded_at) '
+                     'VALUES (:folder, :file_name, :base, :archived_date, :revision, :size, :sha256, :recorded_at)', entry)
+    return entry
+
+def indexed_file(path) -> Optional[Dict[str, Any]]:
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    with closing(open_index()) as conn:
+        row = conn.execute('SELECT * FROM archived_files WHERE folder = ? AND file_name = ?', (folder, file_name)).fetchone()
+    return dict(row) if row else None
+
+def package_fingerprints(zip_ref) -> Dict[str, Tuple[int, int]]:
+    """Size and CRC-32 of every packaged asset, read from the zip central directory without decompressing anything."""
+    return {info.filename: (info.file_size, info.CRC) for info in zip_ref.infolist()
+            if not info.is_dir() and not info.filename.endswith('.twb')}
+
+def record_package_assets(path, fingerprints: Dict[str, Tuple[int, int]]):
+    """Store the asset fingerprints of the package an archived .twb was extracted from."""
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    with closing(open_index()) as conn, conn:
+        conn.execute('DELETE FROM package_assets WHERE folder = ? AND file_name = ?', (folder, file_name))
+        conn.executemany('INSERT INTO package_assets (folder, file_name, asset, size, crc32) VALUES (?, ?, ?, ?, ?)',
+                         [(folder, file_name, asset, size, crc) for asset, (size, crc) in fingerprints.items()])
+
+def load_package_assets(path) -> Dict[str, Tuple[int, int]]:
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    with closing(open_index()) as conn:
+        return {row['asset']: (row['size'], row['crc32']) for row in conn.execute(
+            'SELECT asset, size, crc32 FROM package_assets WHERE folder = ? AND file_name = ?', (folder, file_name))}
+
+def diff_package_assets(old_assets: Dict[str, Tuple[int, int]], new_assets: Dict[str, Tuple[int, int]]) -> Dict[str, List[str]]:
+    """Report packaged extracts, images and other files that were added, removed or changed between two packages."""
+    changes = defaultdict(list)
+    # Plain .twb downloads and copies archived before fingerprinting have no assets to compare against
+    if not old_assets or not new_assets:
+        return changes
+    for asset in sorted(old_assets.keys() | new_assets.keys()):
+        old = old_assets.get(asset)
+        new = new_assets.get(asset)
+        if old is None:
+            changes['package_assets_added'].append(f"{asset} ({new[0]:,} bytes)")
+        elif new is None:
+            changes['package_assets_removed'].append(f"{asset} ({old[0]:,} bytes)")
+        elif old != new:
+            detail = f"size {old[0]:,} -> {new[0]:,} bytes" if old[0] != new[0] else "content changed, same size"
+            changes['package_assets_modified'].append(f"{asset}: {detail}")
+    return changes
+
+def load_dependency_fragments(path) -> Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]]:
+    """Stored dependency graph fragments of an archived copy, keyed by (kind, name); empty if none were stored."""
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    with closing(open_index()) as conn:
+        return {(row['kind'], row['name']): (row['subtree_hash'], json.loads(row['fragment'])) for row in conn.execute(
+            'SELECT kind, name, subtree_hash, fragment FROM dependency_fragments WHERE folder = ? AND file_name = ?', (folder, file_name))}
+
+def record_dependency_fragments(path, fragments: Dict[Tuple[str, str], Tuple[str, Dict[str, Any]]]):
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    with closing(open_index()) as conn, conn:
+        conn.execute('DELETE FROM dependency_fragments WHERE folder = ? AND file_name = ?', (folder, file_name))
+        conn.executemany('INSERT INTO dependency_fragments (folder, file_name, kind, name, subtree_hash, fragment) VALUES (?, ?, ?, ?, ?, ?)',
+                         [(folder, file_name, kind, name, digest, json.dumps(fragment))
+                          for (kind, name), (digest, fragment) in fragments.items()])
+
+def forget_archived_file(path):
+    folder, file_name = os.path.split(remove_long_path_prefix(path))
+    with closing(open_index()) as conn, conn:
+        conn.execute('DELETE FROM archived_files WHERE folder = ? AND file_name = ?', (folder, file_name))
+        conn.execute('DELETE FROM package_assets WHERE folder = ? AND file_name = ?', (folder, file_name))
+        conn.execute('DELETE FROM dependency_fragments WHERE folder = ? AND file_name = ?', (folder, file_name))
+
+def backfill_index(base, wb_folder):
+    """Index copies archived before the index existed; runs once per workbook folder."""
+    if USE_REVISION_STORE:
+        manifest = load_manifest(base, wb_folder)
+        for name, entry in manifest.items():
+            path = os.path.join(wb_folder, name)
+            if indexed_file(path) is None:
+                record_archived_file(path, base, entry['blob'], entry['size'], entry.get('revision'))
+    else:
+        for fn in glob.glob(os.path.join(wb_folder, f"{base}_*.twb")):
+            if indexed_file(fn) is None:
+                logger.info(f"Indexing previously archived copy {fn}")
+                record_archived_file(fn, base)
+    with closing(open_index()) as conn, conn:
+        conn.execute('INSERT OR IGNORE INTO indexed_folders (folder, base) VALUES (?, ?)', (wb_folder, base))
+
+def list_copies(base, wb_folder) -> List[str]:
+    """List archived copies of a workbook from the index, dropping entries whose file has gone."""
+    if USE_REVISION_STORE:
+        ingest_loose_copies(base, wb_folder)
+    with closing(open_index()) as conn:
+        backfilled = conn.execute('SELECT 1 FROM indexed_folders WHERE folder = ? AND base = ?', (wb_folder, base)).fetchone()
+    if not backfilled:
+        backfill_index(base, wb_folder)
+    with closing(open_index()) as conn:
+        names = [row['file_name'] for row in conn.execute('SELECT file_name FROM archived_files WHERE folder = ? AND base = ?', (wb_folder, base))]
+    copies = []
+    for name in names:
+        path = os.path.join(wb_folder, name)
+        if copy_exists(path):
+            copies.append(path)
+        else:
+            logger.warning(f"Dropping index entry for missing copy {path}")
+            forget_archived_file(path)
+    return copies
+
+def read_revision(path):
+    entry = indexed_file(path) or record_archived_file(path, os.path.basename(path).rsplit('_', 1)[0])
+    return entry['revision']
+
+def copy_exists(path):
+    if USE_REVISION_STORE:
+        return manifest_entry(path) is not None
+    return os.path.exists(path)
+
+def remove_copy(path):
+    forget_archived_file(path)
+    if not USE_REVISION_STORE:
+        os.remove(path)
+        return
+    # Identical content is shared between copies, so the blob only goes once the last copy using it has
+    name = os.path.basename(path)
+    base = name.rsplit('_', 1)[0]
+    manifest = load_manifest(base, os.path.dirname(path))
+    entry = manifest.pop(name, None)
+    save_manifest(base, os.path.dirname(path), manifest)
+    if entry is not None:
+        release_blob(entry['blob'])
+
+_OFFSET = struct.Struct('<Q')
+_changelog_locks = defaultdict(threading.Lock)
+_changelog_locks_guard = threading.Lock()
+
+def changelog_lock(wb_folder):
+    with _changelog_locks_guard:
+        return _changelog_locks[os.path.normcase(os.path.abspath(wb_folder))]
+
+def rebuild_changelog_index(wb_folder):
+    """Rewrite changelog.idx from the log itself, dropping a trailing line cut short by a crash."""
+    log_path = os.path.join(wb_folder, CHANGELOG_FILE)
+    offsets = []
+    with open(log_path, 'rb+') as log:
+        offset = 0
+        for line in log:
+            if not line.endswith(b'\n'):
+                log.truncate(offset)
+                logger.warning(f"Dropped incomplete changelog entry at offset {offset} in {log_path}")
+                break
+            offsets.append(offset)
+            offset += len(line)
+    with open(os.path.join(wb_folder, CHANGELOG_INDEX_FILE), 'wb') as idx:
+        idx.write(b''.join(_OFFSET.pack(offset) for offset in offsets))
+    logger.info(f"Rebuilt changelog index for {wb_folder} ({len(offsets)} entries)")
+    return offsets
+
+def changelog_index_is_current(wb_folder):
+    """Check that changelog.idx covers every line of the log by reading only its final entry."""
+    log_path = os.path.join(wb_folder, CHANGELOG_FILE)
+    idx_path = os.path.join(wb_folder, CHANGELOG_INDEX_FILE)
+    log_size = os.path.getsize(log_path)
+    idx_size = os.path.getsize(idx_path) if os.path.exists(idx_path) else 0
+    if idx_size % _OFFSET.size or (idx_size > 0) != (log_size > 0):
+        return False
+    if not idx_size:
+        return True
+    with open(idx_path, 'rb') as idx, open(log_path, 'rb') as log:
+        idx.seek(idx_size - _OFFSET.size)
+        log.seek(_OFFSET.unpack(idx.read(_OFFSET.size))[0])
+        return log.readline().endswith(b'\n') and log.tell() == log_size
+
+def changelog_offsets(wb_folder, last=None) -> List[int]:
+    """Return the offsets of the newest `last` entries (all when None), oldest first."""
+    if not os.path.exists(os.path.join(wb_folder, CHANGELOG_FILE)):
+        return []
+    if not changelog_index_is_current(wb_folder):
+        offsets = rebuild_changelog_index(wb_folder)
+        return offsets if last is None else offsets[max(len(offsets) - last, 0):]
+    with open(os.path.join(wb_folder, CHANGELOG_INDEX_FILE), 'rb') as idx:
+        if last is not None:
+            idx.seek(-min(last * _OFFSET.size, idx.seek(0, os.SEEK_END)), os.SEEK_END)
+        return [offset for (offset,) in _OFFSET.iter_unpack(idx.read())]
+
+def append_changelog(wb_folder, entry: Dict[str, Any]):
+    """Append one comparison to the workbook's changelog; cost does not grow with the history."""
+    line = (json.dumps(entry, ensure_ascii=False, sort_keys=True) + '\n').encode('utf-8')
+    with changelog_lock(wb_folder):
+        # A crash between the two writes below leaves the index one entry short; heal it before appending
+        if os.path.exists(os.path.join(wb_folder, CHANGELOG_FILE)) and not changelog_index_is_current(wb_folder):
+            rebuild_changelog_index(wb_folder)
+        with open(os.path.join(wb_folder, CHANGELOG_FILE), 'ab') as log:
+            offset = log.seek(0, os.SEEK_END)
+            log.write(line)
+        with open(os.path.join(wb_folder, CHANGELOG_INDEX_FILE), 'ab') as idx:
+            idx.write(_OFFSET.pack(offset))
+
+def read_changelog(wb_folder, last=None) -> List[Dict[str, Any]]:
+    """Return changelog entries newest first, limited to the newest `last` when given."""
+    with changelog_lock(wb_folder):
+        offsets = changelog_offsets(wb_folder, last)
+        entries = []
+        if offsets:
+            with open(os.path.join(wb_folder, CHANGELOG_FILE), 'rb') as log:
+                for offset in reversed(offsets):
+                    log.seek(offset)
+                    entries.append(json.loads(log.readline()))
+    return entries
+
+def render_changelog(wb_folder, last=None, file=None):
+    """Print changelog entries newest first, in the same layout changelog.txt used."""
+    comparator = TableauWorkbookComparator()
+    for entry in read_changelog(wb_folder, last):
+        print(f"\n\n=== Comparison on {entry['compared_at']} ===", file=file)
+        print(f"{entry['old_file']} (rev {entry['old_revision']}) -> {entry['new_file']} (rev {entry['new_revision']})", file=file)
+        comparator.print_summary(entry['changes'], file=file, impact=entry.get('impact'))
+
+def search_index_available(conn) -> bool:
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'history_search'").fetchone() is not None
+
+def search_document(path) -> Dict[str, str]:
+    """Reparse an archived revision for its search document, for copies no comparison has indexed. Module level so a process pool can run it."""
+    comparator = TableauWorkbookComparator()
+    return build_search_document(comparator, comparator.index_workbook(comparator.parse_workbook(path)), path)
+
+def build_search_document(comparator, index, path) -> Dict[str, str]:
+    """Pull the searchable text out of an already indexed revision."""
+    found = {column: {} for column in SEARCH_COLUMNS} # Dicts keep the first-seen order without repeats
+    found['workbook'][os.path.basename(path).rsplit('_', 1)[0]] = None
+    for name, datasource in index['datasources'].items():
+        details = comparator.extract_datasource_details(datasource, index)
+        found['datasources'][name] = None
+        for table in details['tables']:
+            found['tables'][table['name']] = None
+        # Federated datasources keep server, database and initial SQL on each connection under named-connections
+        for connection in datasource.iter('connection'):
+            for column, value in (('servers', connection.get('server')), ('databases', connection.get('dbname') or connection.get('database')),
+                                  ('initial_sql', connection.get('initial-sql'))):
+                if value:
+                    found[column][value] = None
+        for relation in comparator.datasource_contents(datasource, index)['relations']:
+            if relation.get('type') == 'text' and relation.text:
+                found['custom_sql'][relation.text.strip()] = None
+        for caption, formula in comparator.extract_calculated_fields(datasource, index).items():
+            if formula:
+                found['formulas'][f"{caption}: {formula}"] = None
+    return {column: '\n'.join(values) for column, values in found.items()}
+
+def index_for_search(base, wb_folder, compare_pool=None):
+    """Add a workbook's archived copies that are not in the search index yet."""
+    with closing(open_index()) as conn:
+        if not search_index_available(conn):
+            return
+        pending = conn.execute(
+            'SELECT a.file_name, a.revision, a.archived_date, a.sha256 FROM archived_files a LEFT JOIN search_documents s '
+            'ON s.folder = a.folder AND s.file_name = a.file_name AND s.sha256 IS a.sha256 WHERE a.folder = ? AND a.base = ? AND s.doc_id IS NULL',
+            (wb_folder, base)).fetchall()
+    for row in pending:
+        path = os.path.join(wb_folder, row['file_name'])
+        try:
+            if compare_pool is not None:
+                document = compare_pool.submit(search_document, path).result()
+            else:
+                document = search_document(path)
+        except XML_PARSE_ERRORS as e:
+            logger.warning(f"Not indexing {path} for search: {e}")
+            continue
+        record_search_document(wb_folder, base, row, document)
+
+def record_search_document(wb_folder, base, entry, document: Dict[str, str]):
+    """Store the search document of an archived copy; entry is its archived_files row."""
+    with closing(open_index()) as conn, conn:
+        if not search_index_available(conn):
+            return
+        cursor = conn.execute('INSERT OR IGNORE INTO search_documents (folder, file_name, base, revision, archived_date, sha256) VALUES (?, ?, ?, ?, ?, ?)',
+                              (wb_folder, entry['file_name'], base, entry['revision'], entry['archived_date'], entry['sha256']))
+        if not cursor.rowcount:
+            return
+        conn.execute(f"INSERT INTO history_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES (?{', ?' * len(SEARCH_COLUMNS)})",
+                     (cursor.lastrowid, *(document[column] for column in SEARCH_COLUMNS)))
+    logger.info(f"Indexed {entry['file_name']} for search")
+
+def search_history(query, field=None, limit=SEARCH_RESULT_LIMIT) -> List[sqlite3.Row]:
+    """Find archived revisions whose extracted text contains every word of query, best matches first."""
+    # Each word is quoted so table names like [dbo].[Orders] need no FTS5 escaping
+    terms = ' '.join('"' + word.replace('"', '""') + '"' for word in query.split())
+    if field:
+        terms = f"{{{field}}} : ({terms})"
+    with closing(open_index()) as conn:
+        return conn.execute(
+            "SELECT d.folder, d.revision, d.archived_date, snippet(history_search, -1, '<<', '>>', '...', 12) AS snippet "
+            "FROM history_search JOIN search_documents d ON d.doc_id = history_search.rowid "
+            "WHERE history_search MATCH ? ORDER BY rank, d.archived_date DESC LIMIT ?", (terms, limit)).fetchall()
+
+def render_search(query, field=None, limit=SEARCH_RESULT_LIMIT, file=None):
+    """Print workbook, revision, archive date and the matching text for each search result."""
+    results = search_history(query, field, limit)
+    for row in results:
+        workbook = os.path.relpath(row['folder'], remove_long_path_prefix(SAVE_DIR))
+        print(f"{workbook}  rev {row['revision']}  {row['archived_date']}  {' '.join(row['snippet'].split())}", file=file)
+    if not results:
+        print(f"No archived revisions match {query!r}", file=file)
+
+def compare_files(old_file, new_file, old_fragments=None):
+    """Compare two archived revisions and trace changed fields to the sheets they reach.
+
+    Module level so a process pool can run it. old_fragments is the stored dependency graph of old_file, if
+    any; the new revision's graph reuses every fragment whose subtree is unchanged. Returns the changes, the
+    impact, both revisions' fragments for storing and new_file's search document, built from the parse the
+    comparison already made.
+    """
+    comparator = TableauWorkbookComparator()
+    changes = comparator.compare_workbooks(old_file, new_file)
+    old_index, new_index = comparator.indexes
+    old_fragments = comparator.dependency_fragments(old_index, old_fragments)
+    new_fragments = comparator.dependency_fragments(new_index, old_fragments)
+    document = build_search_document(comparator, new_index, new_file)
+    return changes, comparator.change_impact(old_fragments, new_fragments), old_fragments, new_fragments, document
+
+def manage_copies(base, ext, wb_folder, compare_pool=None):
     try:
         # Remove long path prefix for file operations
-        wb_folder = wb_folder.replace('\\\\?\\UNC\\', '\\\\').replace('\\\\?\\', '') if wb_folder.startswith('\\\\?\\') else wb_folder
+        wb_folder = remove_long_path_prefix(wb_folder)
         logger.debug(f"Working directory: {wb_folder}")
         
         # Initialize extension for filtering
         ext_to_use = '.twb' if ext.lower() == '.twbx' else ext
         logger.debug(f"Using extension for filtering: {ext_to_use}")
         
-        # Use glob to find all matching .twb files
-        pattern = os.path.join(wb_folder, f"{base}_*.twb")
-        logger.debug(f"Searching for files with pattern: {pattern}")
-        all_files = glob.glob(pattern)
+        # Find all archived .twb copies, on disk or in the revision store
+        all_files = list_copies(base, wb_folder)
         logger.debug(f"All matching files found: {all_files}")
         
         file_dates = []
@@ -544,11 +1738,9 @@ def manage_copies(base, ext, wb_folder):
         to_delete = []
         if file_dates:
             latest_file = file_dates[0][1]
-            latest_root = ET.parse(latest_file).getroot()
-            latest_revision = latest_root.find('.//repository-location').get('revision')
+            latest_revision = read_revision(latest_file)
             for date_, fn in file_dates[1:]:  # Skip the latest file
-                root = ET.parse(fn).getroot()
-                revision = root.find('.//repository-location').get('revision')
+                revision = read_revision(fn)
                 if revision == latest_revision:
                     to_delete.append((date_, fn))
                 else:
@@ -557,111 +1749,368 @@ def manage_copies(base, ext, wb_folder):
         # Delete files with matching revisions beyond the top 5
         to_delete.sort(key=lambda x: x[0], reverse=True)
         for _, fn in to_delete[5:]:
-            os.remove(fn)
+            remove_copy(fn)
             logger.info(f"Deleted old workbook copy with matching revision: {fn}")
         
-        # Initialize changelog entry
-        changelog_path = os.path.join(wb_folder, 'changelog.txt')
-        current_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        changelog_entry = f"\n\n=== Comparison on {current_date} ===\n"
-        
         # Check if comparison is possible and revisions differ
         if len(file_dates) < 2:
             logger.info(f"Skipping comparison: Only {len(file_dates)} .twb file(s) found in {wb_folder}")
+            index_for_search(base, wb_folder, compare_pool)
             return
         
         latest_file = file_dates[0][1]
         second_latest_file = file_dates[1][1]
-        latest_root = ET.parse(latest_file).getroot()
-        second_latest_root = ET.parse(second_latest_file).getroot()
-        latest_revision = latest_root.find('.//repository-location').get('revision')
-        second_latest_revision = second_latest_root.find('.//repository-location').get('revision')
+        latest_revision = read_revision(latest_file)
+        second_latest_revision = read_revision(second_latest_file)
         
         changes = {}  # Initialize changes dictionary
+        impact = {}
+        # Packaged extracts can change without a new workbook revision, so their fingerprints are always compared
+        asset_changes = diff_package_assets(load_package_assets(second_latest_file), load_package_assets(latest_file))
         if latest_revision != second_latest_revision:
             logger.info(f"Comparing workbooks due to revision change: {os.path.basename(second_latest_file)} (rev {second_latest_revision}) with {os.path.basename(latest_file)} (rev {latest_revision})")
-            comparator = TableauWorkbookComparator()
-            changes = comparator.compare_workbooks(second_latest_file, latest_file)
-            
-            # Update changelog only if changes are identified
-            if any(changes.values()):
-                # Prepare comparison output
-                from io import StringIO
-                output = StringIO()
-                sys.stdout = output
-                comparator.print_summary(changes)
-                sys.stdout = sys.__stdout__
-                comparison_text = output.getvalue()
-                output.close()
-                
-                # Append comparison results to changelog
-                changelog_entry += comparison_text
-                existing_content = ""
-                try:
-                    with open(changelog_path, 'r') as f:
-                        existing_content = f.read()
-                except FileNotFoundError:
-                    logger.info(f"Creating new changelog file: {changelog_path}")
-                
-                with open(changelog_path, 'w') as f:
-                    f.write(changelog_entry + existing_content)
-                logger.info(f"Changelog updated at: {changelog_path}")
+            known_fragments = load_dependency_fragments(second_latest_file)
+            if compare_pool is not None:
+                changes, impact, old_fragments, new_fragments, document = compare_pool.submit(
+                    compare_files, second_latest_file, latest_file, known_fragments).result()
+            else:
+                changes, impact, old_fragments, new_fragments, document = compare_files(second_latest_file, latest_file, known_fragments)
+            if not known_fragments:
+                record_dependency_fragments(second_latest_file, old_fragments)
+            record_dependency_fragments(latest_file, new_fragments)
+            # index_for_search below then only reparses copies no comparison has covered
+            record_search_document(wb_folder, base, indexed_file(latest_file), document)
         else:
             logger.info(f"Skipping comparison: No revision change between {os.path.basename(second_latest_file)} (rev {second_latest_revision}) and {os.path.basename(latest_file)} (rev {latest_revision})")
+        changes = {**changes, **asset_changes}
+        
+        # Update changelog only if changes are identified
+        if any(changes.values()):
+            entry = {
+                'compared_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'old_file': os.path.basename(second_latest_file),
+                'old_revision': second_latest_revision,
+                'new_file': os.path.basename(latest_file),
+                'new_revision': latest_revision,
+                'changes': {key: items for key, items in changes.items() if items},
+            }
+            if impact:
+                entry['impact'] = impact
+            append_changelog(wb_folder, entry)
+            logger.info(f"Changelog updated in: {wb_folder}")
         
         # Handle file based on comparison result
-        if not any(changes.values()) and latest_revision == second_latest_revision and os.path.exists(latest_file):
-            os.remove(latest_file)
+        if not any(changes.values()) and latest_revision == second_latest_revision and copy_exists(latest_file):
+            remove_copy(latest_file)
             logger.info(f"Deleted identical latest file with matching revision: {latest_file}")
         elif os.path.exists(latest_file):
             current_date = date.today().isoformat()
             new_filename = f"{os.path.splitext(latest_file)[0]}{ext_to_use}"
             os.rename(latest_file, new_filename)
             logger.info(f"Renamed different latest file to: {new_filename}")
+        index_for_search(base, wb_folder, compare_pool)
     except Exception as e:
         logger.error(f"Error managing copies for {base}{ext} in {wb_folder}: {e}")
         raise
 
+_git_lock = threading.Lock()
+
+def run_git(*args, input=None, stdin=None, env=None) -> str:
+    """Run a git plumbing command against the history repository and return its output.
+
+    stdin, an open binary file, is streamed to git rather than read into memory like input.
+    """
+    command = [GIT_EXECUTABLE, f"--git-dir={GIT_HISTORY_REPO}", *args]
+    env = dict(os.environ, **(env or {}))
+    if isinstance(stdin, gzip.GzipFile):
+        # Revision store blobs only decompress in Python, so they are copied through a pipe in chunks
+        with subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env) as process:
+            try:
+                shutil.copyfileobj(stdin, process.stdin, DOWNLOAD_CHUNK_SIZE)
+            except BrokenPipeError:
+                pass # git stopped reading; its exit status and stderr say why
+            stdout, stderr = process.communicate()
+        returncode = process.returncode
+    else:
+        result = subprocess.run(command, input=input, stdin=stdin, env=env, capture_output=True)
+        returncode, stdout, stderr = result.returncode, result.stdout, result.stderr
+    if returncode != 0:
+        raise RuntimeError(f"git {args[0]} failed: {stderr.decode('utf-8', 'replace').strip()}")
+    return stdout.decode('utf-8').strip()
+
+def git_head() -> Optional[str]:
+    if not os.path.exists(os.path.join(GIT_HISTORY_REPO, 'HEAD')):
+        os.makedirs(GIT_HISTORY_REPO, exist_ok=True)
+        run_git('init', '--bare', '--quiet')
+        run_git('symbolic-ref', 'HEAD', GIT_HISTORY_BRANCH)
+        logger.info(f"Created workbook history repository at {GIT_HISTORY_REPO}")
+    try:
+        return run_git('rev-parse', '--verify', '--quiet', f"{GIT_HISTORY_BRANCH}^{{commit}}")
+    except RuntimeError:
+        return None
+
+def commit_to_git(path, repo_path, metadata: Dict[str, str]) -> Optional[str]:
+    """Commit an archived .twb as repo_path on top of the history branch; returns None if it was already there."""
+    with _git_lock, open_twb(path) as f, tempfile.TemporaryDirectory() as temp_dir:
+        parent = git_head()
+        blob = run_git('hash-object', '-w', '--stdin', stdin=f)
+        # A throwaway index, so the commit is built without a working tree or touching anyone else's index
+        index_env = {'GIT_INDEX_FILE': os.path.join(temp_dir, 'index')}
+        if parent:
+            run_git('read-tree', parent, env=index_env)
+        else:
+            run_git('read-tree', '--empty', env=index_env)
+        run_git('update-index', '--add', '--cacheinfo', f"100644,{blob},{repo_path}", env=index_env)
+        tree = run_git('write-tree', env=index_env)
+        if parent and tree == run_git('rev-parse', f"{parent}^{{tree}}"):
+            return None
+        message = f"{repo_path} revision {metadata['Revision']}\n\n" + ''.join(f"{key}: {value}\n" for key, value in metadata.items())
+        author = metadata.get('Owner') or 'Tableau'
+        commit_env = {
+            'GIT_AUTHOR_NAME': author, 'GIT_AUTHOR_EMAIL': '', 'GIT_AUTHOR_DATE': metadata['Updated-At'],
+            'GIT_COMMITTER_NAME': 'Tableau version control', 'GIT_COMMITTER_EMAIL': '',
+        }
+        commit = run_git('commit-tree', tree, *(['-p', parent] if parent else []), input=message.encode('utf-8'), env=commit_env)
+        # Only moves the branch if nobody else did since it was read
+        run_git('update-ref', GIT_HISTORY_BRANCH, commit, parent or '0' * 40)
+        return commit
+
+def commit_copies_to_git(job):
+    """Commit a workbook's archived copies to git, oldest first, then drop all but the latest from its folder."""
+    wb_folder = remove_long_path_prefix(job['wb_folder'])
+    base = job['base']
+    repo_path = f"{os.path.relpath(wb_folder, remove_long_path_prefix(SAVE_DIR)).replace(os.sep, '/')}.twb"
+    current = os.path.basename(archived_copy_path(job))
+    copies = sorted(list_copies(base, wb_folder), key=lambda path: archive_date(base, os.path.basename(path)) or '')
+    for path in copies:
+        # Copies from before git history was turned on only know the day they were archived
+        is_current = os.path.basename(path) == current
+        metadata = {
+            'Revision': read_revision(path),
+            'Updated-At': job['updated_at'] if is_current else f"{archive_date(base, os.path.basename(path))}T00:00:00Z",
+            'Owner': job.get('owner') or '',
+            'Workbook-Id': job['id'],
+            'Project': job['project_name'],
+        }
+        commit = commit_to_git(path, repo_path, metadata)
+        if commit:
+            logger.info(f"Committed {os.path.basename(path)} to workbook history as {commit[:12]}")
+    for path in copies[:-1]:
+        remove_copy(path)
+        logger.info(f"Removed {path}; it is kept in workbook history")
+
+JOURNAL_STATES = ('listed', 'downloaded', 'extracted', 'compared', 'done')
+
+def journal_job(job, state):
+    """Record that a workbook has completed the step named by state in this run."""
+    job['state'] = state
+    with closing(open_index()) as conn, conn:
+        conn.execute(
+            'INSERT OR REPLACE INTO run_journal (workbook_id, updated_at, state, base, ext, wb_folder, server_revision, changed_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job['id'], job['updated_at'], state, job.get('base'), job.get('ext'), job.get('wb_folder'),
+             job.get('server_revision'), datetime.now().isoformat(timespec='seconds')))
+
+def archived_copy_path(job):
+    """Path of the .twb archived for this job's updatedAt, whether extracted from a package or downloaded as is."""
+    mod_date = job['updated_at'].rstrip('Z').split('T')[0]
+    return os.path.join(remove_long_path_prefix(job['wb_folder']), f"{job['base']}_{mod_date}.twb")
+
+def reached(job, state):
+    return JOURNAL_STATES.index(job['state']) >= JOURNAL_STATES.index(state)
+
+def resume_jobs(jobs) -> List[Dict[str, Any]]:
+    """Restore each workbook's progress from earlier runs and return the ones with work left."""
+    cutoff = (datetime.now() - timedelta(days=JOURNAL_RETENTION_DAYS)).isoformat(timespec='seconds')
+    pending = []
+    new_jobs = []
+    with closing(open_index()) as conn:
+        with conn:
+            conn.execute('DELETE FROM run_journal WHERE changed_at < ?', (cutoff,))
+        for job in jobs:
+            # Keyed on updatedAt too, so a workbook republished since the interrupted run starts from scratch
+            row = conn.execute('SELECT * FROM run_journal WHERE workbook_id = ? AND updated_at = ?',
+                               (job['id'], job['updated_at'])).fetchone()
+            job['state'] = 'listed'
+            if row is None:
+                new_jobs.append(job)
+                pending.append(job)
+                continue
+            if row['state'] == 'done':
+                logger.info(f"Skipping {job['name']}: finished by an earlier run")
+                continue
+            job.update(base=row['base'], ext=row['ext'], wb_folder=row['wb_folder'], server_revision=row['server_revision'])
+            state = row['state']
+            if state in ('downloaded', 'extracted'):
+                archived = archived_copy_path(job)
+                if state == 'downloaded' and job['ext'].lower() == '.twbx':
+                    # Packages are only held in memory until their .twb is extracted
+                    state = 'listed'
+                elif not copy_exists(archived):
+                    logger.warning(f"Archived copy {archived} from an interrupted run is missing; downloading {job['name']} again")
+                    state = 'listed'
+            job['state'] = state
+            if state != 'listed':
+                logger.info(f"Resuming {job['name']} after its '{state}' step")
+            pending.append(job)
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO run_journal (workbook_id, updated_at, state, changed_at) VALUES (?, ?, ?, ?)',
+                [(job['id'], job['updated_at'], 'listed', datetime.now().isoformat(timespec='seconds')) for job in new_jobs])
+    return pending
+
+_STOP = object()
+
+def run_stage(stage_name, process, in_queue, out_queue, failures):
+    """Pull workbooks off in_queue, process them and pass the ones that need more work downstream."""
+    while True:
+        job = in_queue.get()
+        if job is _STOP:
+            return
+        try:
+            forward = process(job)
+        except Exception as e:
+            logger.error(f"{stage_name} stage failed for workbook {job['name']}: {e}")
+            failures.append((job['name'], stage_name, e))
+            continue
+        if forward and out_queue is not None:
+            # Blocks while the next stage is backed up, which throttles this stage to its pace
+            out_queue.put(job)
+
+def run_pipeline(jobs, stages):
+    """Run jobs through (name, process, workers) stages joined by bounded queues and return the failures."""
+    failures = []
+    queues = [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in stages]
+    stage_threads = []
+    for i, (stage_name, process, workers) in enumerate(stages):
+        out_queue = queues[i + 1] if i + 1 < len(stages) else None
+        threads = [threading.Thread(target=run_stage, args=(stage_name, process, queues[i], out_queue, failures),
+                                    name=f"{stage_name}-{n}", daemon=True) for n in range(workers)]
+        for t in threads:
+            t.start()
+        stage_threads.append(threads)
+    for job in jobs:
+        queues[0].put(job)
+    # Stop stages in order so each one drains completely before the next is told to finish
+    for i, threads in enumerate(stage_threads):
+        for _ in threads:
+            queues[i].put(_STOP)
+        for t in threads:
+            t.join()
+    return failures
+
+def download_stage(server, api_version, site_id, token, job):
+    if reached(job, 'downloaded'):
+        return True
+    logger.info(f"Processing workbook {job['name']} in project {job['project_name']} modified at {job['updated_at']}")
+    if PRECHECK_REVISIONS:
+        job['server_revision'] = get_server_revision(server, api_version, site_id, token, job['id'])
+        recorded = load_server_revision(job['id'])
+        if job['server_revision'] is not None and recorded is not None and job['server_revision'] == recorded['revision']:
+            # An extract refresh changes a packaged workbook's data and updatedAt without a new revision
+            if recorded['ext'] == '.twb' or recorded['updated_at'] == job['updated_at']:
+                logger.info(f"Skipping download of {job['name']}: server revision {recorded['revision']} is already archived")
+                journal_job(job, 'done')
+                return False
+            logger.info(f"Downloading {job['name']} again: revision {recorded['revision']} is archived but its package may have new data")
+    job['base'], job['ext'], job['filename'], job['wb_folder'], job['package'] = download_workbook(
+        server, api_version, site_id, token, job['id'], job['updated_at'], job['name'], job['project_name'])
+    journal_job(job, 'downloaded')
+    return True
+
+def extract_stage(job):
+    if reached(job, 'extracted'):
+        return True
+    package = job.pop('package', None)
+    if package is not None:
+        try:
+            twb_files = extract_twbx(package, job['wb_folder'], job['base'], mod_date=job['updated_at'].rstrip('Z').split('T')[0])
+        finally:
+            package.close()
+        if not twb_files:
+            return False
+    journal_job(job, 'extracted')
+    return True
+
+def compare_stage(compare_pool, job):
+    if not reached(job, 'compared'):
+        manage_copies(job['base'], job['ext'], job['wb_folder'], compare_pool)
+        if USE_GIT_HISTORY:
+            commit_copies_to_git(job)
+        journal_job(job, 'compared')
+    if job.get('server_revision') is not None:
+        record_server_revision(job['id'], job['server_revision'], job['updated_at'], job['ext'].lower())
+    journal_job(job, 'done')
+    return True
+
 def main():
     try:
         logger.debug(f"Using SAVE_DIR: {SAVE_DIR}")
         if not os.path.exists(SAVE_DIR):
             logger.error(f"SAVE_DIR does not exist: {SAVE_DIR}")
             raise OSError(f"SAVE_DIR does not exist: {SAVE_DIR}")
+        tabretry.configure(MAX_REQUESTS_PER_SECOND, max_retries=MAX_RETRIES)
         token, site_id = sign_in(SERVER_URL, API_VERSION, TOKEN_NAME, TOKEN_SECRET, SITE_CONTENT_URL)
         workbooks = get_all_workbooks(SERVER_URL, API_VERSION, site_id, token)
         if not workbooks:
             logger.info("No workbooks found in allowed projects")
             return
+        jobs = []
         for wb in workbooks:
             if not isinstance(wb, dict):
                 logger.error(f"Invalid workbook entry: {wb}")
                 continue
-            wb_id = wb.get('id')
-            name = wb.get('name')
-            updated_at = wb.get('updatedAt')
-            project_name = wb.get('project', {}).get('name')
-            if not all([wb_id, name, updated_at, project_name]):
+            job = {
+                'id': wb.get('id'),
+                'name': wb.get('name'),
+                'updated_at': wb.get('updatedAt'),
+                'project_name': wb.get('project', {}).get('name')
+            }
+            if not all(job.values()):
                 logger.error(f"Missing required fields in workbook: {wb}")
                 continue
-            logger.info(f"Processing workbook {name} in project {project_name} modified at {updated_at}")
-            base, ext, new_filename, wb_folder = download_workbook(SERVER_URL, API_VERSION, site_id, token, wb_id, updated_at, name, project_name)
-            if ext.lower() == '.twbx':
-                twb_files = extract_twbx(os.path.join(wb_folder, new_filename), wb_folder, base, mod_date=updated_at.rstrip('Z').split('T')[0])
-                if twb_files:
-                    manage_copies(base, '.twb', wb_folder)
-                os.remove(os.path.join(wb_folder, new_filename))
-                logger.info(f"Deleted original .twbx file: {new_filename}")
-            else:
-                manage_copies(base, ext, wb_folder)
+            owner = wb.get('owner', {})
+            job['owner'] = owner.get('name') or owner.get('id')
+            jobs.append(job)
+        listed = len(jobs)
+        jobs = resume_jobs(jobs)
+        logger.info(f"{len(jobs)} of {listed} workbooks need work in this run")
+        # Workbooks flow through download -> extract -> compare concurrently, so a run takes about as long as its slowest stage
+        # Comparisons run in worker processes; the changes come back to this process, which writes each changelog.
+        # Workers are spawned, not forked, since the pipeline's threads are already running when they start
+        with ProcessPoolExecutor(max_workers=COMPARE_PROCESSES, mp_context=multiprocessing.get_context('spawn')) as compare_pool:
+            failures = run_pipeline(jobs, [
+                ('download', partial(download_stage, SERVER_URL, API_VERSION, site_id, token), DOWNLOAD_WORKERS),
+                ('extract', extract_stage, EXTRACT_WORKERS),
+                ('compare', partial(compare_stage, compare_pool), COMPARE_WORKERS),
+            ])
+        if USE_GIT_HISTORY and os.path.exists(GIT_HISTORY_REPO):
+            # Packs the night's loose objects into delta-compressed packfiles once enough have built up
+            run_git('gc', '--auto', '--quiet')
         sign_out_url = f"{SERVER_URL}/api/{API_VERSION}/auth/signout"
         req = urllib.request.Request(sign_out_url, method='POST')
         req.add_header('X-Tableau-Auth', token)
-        urllib.request.urlopen(req)
+        tabretry.urlopen(req)
         logger.info("Signed out successfully")
+        logger.info(f"Server requests: {tabretry.STATS.summary()}")
+        if failures:
+            failed = ', '.join(f"{name} ({stage_name})" for name, stage_name, _ in failures)
+            raise RuntimeError(f"{len(failures)} of {len(jobs)} workbooks failed: {failed}")
     except Exception as e:
         logger.error(f"Error in main: {e}")
         raise
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Archive Tableau workbook revisions and log what changed between them.")
+    parser.add_argument('--changelog', metavar='WORKBOOK_FOLDER', help="Print this workbook folder's changelog, newest first, instead of running")
+    parser.add_argument('--last', type=int, help="With --changelog, only print the newest N entries")
+    parser.add_argument('--search', metavar='TEXT', help="List archived revisions whose formulas, SQL, tables, servers or databases contain every word of TEXT")
+    parser.add_argument('--field', choices=SEARCH_COLUMNS, help="With --search, only look in this field")
+    parser.add_argument('--limit', type=int, default=SEARCH_RESULT_LIMIT, help="With --search, the most results to print")
+    args = parser.parse_args()
+    if args.changelog:
+        render_changelog(args.changelog, args.last)
+    elif args.search:
+        render_search(args.search, args.field, args.limit)
+    else:
+        main()
\ No newline at end of file
@@ -7,6 +7,7 @@ import pandas as pd
 from datetime import datetime, timezone
 import tableauserverclient as tsc
 from ldap3 import Server, Connection, ALL, SUBTREE
+import tabretry
 
 class App(tk.Tk):
     def __init__(self):
@@ -58,7 +59,8 @@ class App(tk.Tk):
         self.ldap_password = d['LDAP Password']
         self.ldap_base_dn = d['LDAP Base DN']
         self.auth = tsc.PersonalAccessTokenAuth(self.token_name, self.token_value, self.site_id)
-        self.server = tsc.Server(self.server_url)
+        # Requests made by tsc, including every tsc.Pager page, are retried when the server throttles or fails them
+        self.server = tsc.Server(self.server_url, session_factory=tabretry.retrying_session)
         # self.server.add_http_options({'verify': False})  # Uncomment if certificate issues
 
     def test_auth(self):
@@ -453,18 +455,22 @@ class ReportsFrame(tk.Frame):
         thread.start()
 
     def run_report(self, func):
+        requests_before = tabretry.STATS.snapshot()
         try:
             file_path = func()
-            self.parent.after(0, lambda: self.show_success(file_path))
+            request_summary = tabretry.STATS.summary(since=requests_before)
+            self.parent.after(0, lambda: self.show_success(file_path, request_summary))
         except Exception as exc:
             error_message = str(exc)
             self.parent.after(0, lambda: self.show_error(error_message))
 
-    def show_success(self, path):
+    def show_success(self, path, request_summary=None):
         self.loading.destroy()
         success = tk.Toplevel(self)
         success.title("Success")
         tk.Label(success, text=f"Report generated successfully and saved to {path}.").pack(padx=20, pady=20)
+        if request_summary:
+            tk.Label(success, text=f"Server requests: {request_summary}").pack(padx=20)
         tk.Button(success, text="OK", bg='#00BFFF', fg='white', font=('Arial', 12, 'bold'), command=success.destroy).pack(pady=10)
 
     def show_error(self, err):
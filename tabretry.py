@@ -0,0 +1,211 @@
+"""Retry, backoff and rate limiting shared by the Tableau scripts in this folder.
+
+Every request goes through one token bucket, so a script's threads together stay under the configured
+requests per second. Throttled (429), unavailable and gateway responses are retried with exponential
+backoff and full jitter, or after the server's Retry-After when it sends one; a Retry-After also holds
+back every other thread until it has passed. Counters for retries and throttling are kept in STATS.
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0 # Seconds; attempt n waits a random time up to BACKOFF_BASE * 2**n
+BACKOFF_MAX = 60.0
+MAX_RETRY_AFTER = 300.0 # Longest Retry-After honoured, in seconds
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# A request that changes something is only repeated when the server says it was not processed
+NOT_PROCESSED_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+class TokenBucket:
+    """Thread-safe token bucket; a rate of None means no limit."""
+    def __init__(self, rate: Optional[float] = None, burst: Optional[int] = None):
+        self.lock = threading.Lock()
+        self.configure(rate, burst)
+        self.not_before = 0.0
+
+    def configure(self, rate: Optional[float], burst: Optional[int] = None):
+        with self.lock:
+            self.rate = rate
+            self.capacity = max(burst or (rate or 1), 1)
+            self.tokens = self.capacity
+            self.updated = time.monotonic()
+
+    def hold(self, seconds: float):
+        """Stop handing out tokens for the next `seconds`, e.g. while the server has asked everyone to back off."""
+        with self.lock:
+            self.not_before = max(self.not_before, time.monotonic() + seconds)
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until one is available, and return how long that took."""
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                delay = self.not_before - now
+                if delay <= 0:
+                    if self.rate is None:
+                        return waited
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+                    delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+class RetryStats:
+    """Thread-safe counters: requests sent, retries, throttled responses, rate-limit waits and requests given up on."""
+    FIELDS = ('requests', 'retries', 'throttled', 'rate_limited', 'failures')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+        self.wait_seconds = 0.0
+
+    def count(self, field: str, n: int = 1):
+        with self.lock:
+            self.counts[field] += n
+
+    def add_wait(self, seconds: float):
+        with self.lock:
+            self.counts['rate_limited'] += 1
+            self.wait_seconds += seconds
+
+    def snapshot(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(self.counts, wait_seconds=round(self.wait_seconds, 1))
+
+    def summary(self, since: Optional[Dict[str, float]] = None) -> str:
+        """One-line summary, optionally only of what happened after the `since` snapshot."""
+        current = self.snapshot()
+        if since:
+            current = {key: value - since.get(key, 0) for key, value in current.items()}
+            current['wait_seconds'] = round(current['wait_seconds'], 1)
+        return (f"{current['requests']} requests, {current['retries']} retries, {current['throttled']} throttled, "
+                f"{current['rate_limited']} rate-limit waits ({current['wait_seconds']}s), {current['failures']} gave up")
+
+LIMITER = TokenBucket()
+STATS = RetryStats()
+
+def configure(max_requests_per_second: Optional[float] = None, burst: Optional[int] = None, max_retries: Optional[int] = None):
+    """Set the shared request rate (None for unlimited) and retry count for this process."""
+    global MAX_RETRIES
+    LIMITER.configure(max_requests_per_second, burst)
+    if max_retries is not None:
+        MAX_RETRIES = max_retries
+
+def retry_after_seconds(value) -> Optional[float]:
+    """Parse a Retry-After header given as seconds or as an HTTP date."""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            when = email.utils.parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - datetime.now(timezone.utc)).total_seconds()
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+def backoff_delay(attempt: int) -> float:
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def call_with_retry(send, describe, retry_statuses=RETRY_STATUSES, transient_errors=()):
+    """Call send() under the shared rate limit until it succeeds or retries run out.
+
+    send returns (result, status, headers). Results with a status in retry_statuses are retried, and the
+    last one is returned once retries run out; exceptions in transient_errors are retried and then re-raised.
+    """
+    attempt = 0
+    while True:
+        waited = LIMITER.acquire()
+        if waited:
+            STATS.add_wait(waited)
+        STATS.count('requests')
+        try:
+            result, status, headers = send()
+        except transient_errors as e:
+            if attempt >= MAX_RETRIES:
+                STATS.count('failures')
+                raise
+            reason = f"{type(e).__name__}: {e}"
+            delay = backoff_delay(attempt)
+        else:
+            if status not in retry_statuses:
+                return result
+            if attempt >= MAX_RETRIES:
+                STATS.count('failures')
+                return result
+            reason = f"HTTP {status}"
+            retry_after = retry_after_seconds(headers.get('Retry-After') if headers is not None else None)
+            if status == 429 or retry_after is not None:
+                STATS.count('throttled')
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, BACKOFF_BASE)
+                LIMITER.hold(delay)
+            else:
+                delay = backoff_delay(attempt)
+            close = getattr(result, 'close', None)
+            if close is not None:
+                close()
+        attempt += 1
+        STATS.count('retries')
+        logger.warning(f"{describe} failed ({reason}); retry {attempt} of {MAX_RETRIES} in {delay:.1f}s")
+        time.sleep(delay)
+
+def urlopen(request, timeout=None):
+    """urllib.request.urlopen through the shared retry policy and rate limit; raises HTTPError as usual."""
+    if isinstance(request, str):
+        request = urllib.request.Request(request)
+    method = request.get_method()
+
+    def send():
+        try:
+            response = urllib.request.urlopen(request, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            return e, e.code, e.headers
+        return response, response.status, response.headers
+
+    idempotent = method in IDEMPOTENT_METHODS
+    result = call_with_retry(send, f"{method} {request.full_url}",
+                             RETRY_STATUSES if idempotent else NOT_PROCESSED_STATUSES,
+                             (urllib.error.URLError, ConnectionError, TimeoutError) if idempotent else ())
+    if isinstance(result, urllib.error.HTTPError):
+        raise result
+    return result
+
+def retrying_session(session=None):
+    """Return a requests session (a new one by default) whose requests use the shared retry policy and rate limit.
+
+    Takes no arguments when called as tableauserverclient's session_factory.
+    """
+    import requests
+    if session is None:
+        session = requests.Session()
+    send_request = session.request
+
+    def request(method, url, *args, **kwargs):
+        def send():
+            response = send_request(method, url, *args, **kwargs)
+            return response, response.status_code, response.headers
+        idempotent = method.upper() in IDEMPOTENT_METHODS
+        return call_with_retry(send, f"{method.upper()} {url}",
+                               RETRY_STATUSES if idempotent else NOT_PROCESSED_STATUSES,
+                               (requests.ConnectionError, requests.Timeout) if idempotent else (requests.exceptions.ConnectTimeout,))
+
+    session.request = request
+    return session